@@ -39,7 +39,64 @@ class Settings:
     UPLOAD_DIR: Path = Path("uploads")
     GENERATED_DIR: Path = Path("generated")
     MAX_FILE_SIZE: int = 10 * 1024 * 1024  # 10MB
+    UPLOAD_CHUNK_SIZE: int = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+    # Uploads above this many pixels are rejected from their header, before any decode
+    MAX_IMAGE_PIXELS: int = int(os.getenv("MAX_IMAGE_PIXELS", str(40_000_000)))
     ALLOWED_EXTENSIONS: set = {".jpg", ".jpeg", ".png", ".webp"}
+    # Upload blobs no upload references are deleted once unused this long (seconds), checked every interval
+    UPLOAD_SWEEP_GRACE: float = float(os.getenv("UPLOAD_SWEEP_GRACE", str(24 * 3600)))
+    UPLOAD_SWEEP_INTERVAL: float = float(os.getenv("UPLOAD_SWEEP_INTERVAL", "3600"))  # 0 disables
+    
+    # Large prompt analyses are split into parallel batches of this size
+    ANALYSIS_CHUNK_SIZE: int = int(os.getenv("ANALYSIS_CHUNK_SIZE", "20"))
+    ANALYSIS_MAX_PARALLEL: int = int(os.getenv("ANALYSIS_MAX_PARALLEL", "5"))
+
+    # Generated images are stored as returned by the model unless a transcode is configured
+    GENERATED_TRANSCODE_FORMAT: str = os.getenv("GENERATED_TRANSCODE_FORMAT", "")  # "", PNG, JPEG or WEBP
+    GENERATED_TRANSCODE_QUALITY: int = int(os.getenv("GENERATED_TRANSCODE_QUALITY", "90"))
+    # Delivery variants encoded next to each master, as FORMAT:QUALITY pairs (empty disables)
+    GENERATED_VARIANT_FORMATS: str = os.getenv("GENERATED_VARIANT_FORMATS", "WEBP:80")
+    ENCODE_WORKERS: int = int(os.getenv("ENCODE_WORKERS", "2"))
+    # Timeline thumbnail and inline blur placeholder generated alongside each image
+    THUMBNAIL_MAX_EDGE: int = int(os.getenv("THUMBNAIL_MAX_EDGE", "320"))
+    PLACEHOLDER_MAX_EDGE: int = int(os.getenv("PLACEHOLDER_MAX_EDGE", "16"))
+
+    # Resized derivatives of generated images served by /images/{filename}
+    DERIVATIVE_DIR: Path = Path(os.getenv("DERIVATIVE_DIR", "derivatives"))
+    DERIVATIVE_CACHE_MAX_BYTES: int = int(os.getenv("DERIVATIVE_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+    DERIVATIVE_MAX_EDGE: int = int(os.getenv("DERIVATIVE_MAX_EDGE", "4096"))
+    DERIVATIVE_QUALITY: int = int(os.getenv("DERIVATIVE_QUALITY", "80"))
+
+    # Prompt analysis cache, keyed by upload content hash
+    PROMPT_CACHE_PATH: Path = Path(os.getenv("PROMPT_CACHE_PATH", "prompt_cache.db"))
+    PROMPT_CACHE_TTL: float = float(os.getenv("PROMPT_CACHE_TTL", str(7 * 24 * 3600)))
+    PROMPT_CACHE_MAX_ENTRIES: int = int(os.getenv("PROMPT_CACHE_MAX_ENTRIES", "10000"))
+    
+    # File metadata store: "sqlite" (default) or the legacy "json" file.
+    # The SQLite store imports METADATA_JSON_PATH once on first start.
+    METADATA_BACKEND: str = os.getenv("METADATA_BACKEND", "sqlite").lower()
+    METADATA_DB_PATH: Path = Path(os.getenv("METADATA_DB_PATH", "file_metadata.db"))
+    # Seconds a worker waits for another process's metadata write to finish
+    METADATA_DB_BUSY_TIMEOUT: float = float(os.getenv("METADATA_DB_BUSY_TIMEOUT", "30"))
+    METADATA_JSON_PATH: Path = Path(os.getenv("METADATA_JSON_PATH", "file_metadata.json"))
+    # JSON store only: journal fsync batching window and compaction threshold
+    METADATA_JOURNAL_FSYNC_INTERVAL: float = float(os.getenv("METADATA_JOURNAL_FSYNC_INTERVAL", "0.05"))
+    METADATA_JOURNAL_COMPACT_BYTES: int = int(os.getenv("METADATA_JOURNAL_COMPACT_BYTES", str(8 * 1024 * 1024)))
+
+    # Files that are never rewritten under the same name may be cached this long (seconds)
+    IMMUTABLE_MAX_AGE: int = int(os.getenv("IMMUTABLE_MAX_AGE", str(365 * 24 * 3600)))
+    # Internal nginx location mapped to GENERATED_DIR; when set, /download hands the body to nginx
+    ACCEL_REDIRECT_PREFIX: str = os.getenv("ACCEL_REDIRECT_PREFIX", "")
+
+    # History listings: default and maximum page size for /files and /generations
+    HISTORY_PAGE_SIZE: int = int(os.getenv("HISTORY_PAGE_SIZE", "50"))
+    HISTORY_MAX_PAGE_SIZE: int = int(os.getenv("HISTORY_MAX_PAGE_SIZE", "200"))
+
+    # Background generation jobs
+    JOBS_DB_PATH: Path = Path(os.getenv("JOBS_DB_PATH", "jobs.db"))
+    JOB_WORKERS: int = int(os.getenv("JOB_WORKERS", "2"))
+    # A running job's claim lapses this long after its worker last renewed it (seconds)
+    JOB_LEASE_SECONDS: float = float(os.getenv("JOB_LEASE_SECONDS", "60"))
     
     # Frontend URL
     FRONTEND_URL: str = os.getenv("FRONTEND_URL", "https://vibeboost.online")
@@ -51,6 +108,34 @@ class Settings:
     # Generation configuration
     NUM_IMAGES: int = int(os.getenv("NUM_IMAGES", "3"))
 
+    # Normalized copy of each upload sent to the model (cached next to the upload)
+    MODEL_INPUT_MAX_EDGE: int = int(os.getenv("MODEL_INPUT_MAX_EDGE", "1536"))
+    MODEL_INPUT_FORMAT: str = os.getenv("MODEL_INPUT_FORMAT", "WEBP")  # WEBP or JPEG
+    MODEL_INPUT_QUALITY: int = int(os.getenv("MODEL_INPUT_QUALITY", "90"))
+
+    # Gemini client configuration
+    GEMINI_API_KEY: str = os.getenv("GEMINI_API_KEY", "")
+    GEMINI_MODEL: str = os.getenv("GEMINI_MODEL", "gemini-2.5-flash-image-preview")
+    GEMINI_CLIENT_POOL_SIZE: int = int(os.getenv("GEMINI_CLIENT_POOL_SIZE", "2"))
+    GEMINI_MAX_CONCURRENCY: int = int(os.getenv("GEMINI_MAX_CONCURRENCY", "10"))
+
+    # Outbound model call scheduling (rate limit, backoff on 429/503)
+    MODEL_REQUESTS_PER_MINUTE: int = int(os.getenv("MODEL_REQUESTS_PER_MINUTE", "60"))
+    MODEL_RATE_LIMIT_BURST: int = int(os.getenv("MODEL_RATE_LIMIT_BURST", "0"))  # 0 = GEMINI_MAX_CONCURRENCY
+    MODEL_MAX_QUEUE_WAIT: float = float(os.getenv("MODEL_MAX_QUEUE_WAIT", "120"))
+    MODEL_MAX_RETRIES: int = int(os.getenv("MODEL_MAX_RETRIES", "4"))
+    MODEL_BACKOFF_BASE: float = float(os.getenv("MODEL_BACKOFF_BASE", "1.0"))
+    MODEL_BACKOFF_MAX: float = float(os.getenv("MODEL_BACKOFF_MAX", "30"))
+
+    # Per-user fair-share scheduling of generation calls (weights come from SUBSCRIPTION_PLANS)
+    FAIR_SHARE_CAPACITY: int = int(os.getenv("FAIR_SHARE_CAPACITY", "0"))  # 0 = GEMINI_MAX_CONCURRENCY
+    FAIR_SHARE_MAX_IN_FLIGHT_PER_USER: int = int(os.getenv("FAIR_SHARE_MAX_IN_FLIGHT_PER_USER", "4"))
+
+    # Model health / circuit breaker configuration
+    MODEL_HEALTH_FAILURE_THRESHOLD: int = int(os.getenv("MODEL_HEALTH_FAILURE_THRESHOLD", "5"))
+    MODEL_HEALTH_RESET_TIMEOUT: float = float(os.getenv("MODEL_HEALTH_RESET_TIMEOUT", "30"))
+    MODEL_HEALTH_PROBE_INTERVAL: float = float(os.getenv("MODEL_HEALTH_PROBE_INTERVAL", "60"))
+
     # Stripe Configuration
     STRIPE_PUBLISHABLE_KEY: str = os.getenv("STRIPE_PUBLISHABLE_KEY", "pk_test_51Rb16KDApD6mGm7q2O5pkiPKaODXtvRpkSphnv4k3gMD9JhKSMGJRi22LaioyHuYy30yeuv3qVDVmkuL36sVmCV200Xsrbsv0w")
     STRIPE_SECRET_KEY: str = os.getenv("STRIPE_SECRET_KEY", "sk_test_51Rb16KDApD6mGm7qK5AGONDfZbG1Lbjq99sWVV1qvf9M2dOzzstY9oJMn3t55CH7AQpnmoCasDbHG0s3Sk4bHqjI00Igg29QLs")
@@ -62,6 +147,7 @@ class Settings:
             "name": "Free",
             "price": 0,
             "credits": 15,
+            "priority_weight": 1,
             "stripe_product_id": None,
             "stripe_price_id": None
         },
@@ -69,6 +155,7 @@ class Settings:
             "name": "Basic",
             "price": 1200,  # $12.00 in cents
             "credits": 100,
+            "priority_weight": 2,
             "stripe_product_id": "prod_T6KHyx8rT3FuZw",
             "stripe_price_id": None  # Will be set from Stripe
         },
@@ -76,6 +163,7 @@ class Settings:
             "name": "Pro",
             "price": 3900,  # $39.00 in cents
             "credits": 500,
+            "priority_weight": 4,
             "stripe_product_id": "prod_T6KWg56uGCU5M8",
             "stripe_price_id": None  # Will be set from Stripe
         },
@@ -83,6 +171,7 @@ class Settings:
             "name": "Business",
             "price": 8900,  # $89.00 in cents
             "credits": 1500,
+            "priority_weight": 8,
             "stripe_product_id": "prod_T6KXqIAYquAPt1",
             "stripe_price_id": None  # Will be set from Stripe
         },
@@ -90,6 +179,7 @@ class Settings:
             "name": "Enterprise",
             "price": None,  # Custom pricing
             "credits": None,  # Unlimited or custom
+            "priority_weight": 8,
             "stripe_product_id": None,
             "stripe_price_id": None,
             "contact_required": True
@@ -103,6 +193,7 @@ class Settings:
         # Create directories if they don't exist
         self.UPLOAD_DIR.mkdir(exist_ok=True)
         self.GENERATED_DIR.mkdir(exist_ok=True)
+        self.DERIVATIVE_DIR.mkdir(exist_ok=True)
 
         # Allow overriding CORS origins from env (comma-separated)
         cors_env = os.getenv("CORS_ALLOWED_ORIGINS") or os.getenv("ALLOWED_ORIGINS")
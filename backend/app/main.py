@@ -1,10 +1,11 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 
 from app.core.config import settings
 from app.routers import auth, files
 from app.routers import subscriptions_simple as subscriptions
+from app.services.file_delivery import CachedStaticFiles
+from app.services.image_output import is_run_scoped
 
 app = FastAPI(title=settings.API_TITLE, version=settings.API_VERSION)
 
@@ -17,9 +18,9 @@ app.add_middleware(
     allow_headers=settings.ALLOWED_HEADERS,
 )
 
-# Mount static files
-app.mount("/uploads", StaticFiles(directory=settings.UPLOAD_DIR), name="uploads")
-app.mount("/generated", StaticFiles(directory=settings.GENERATED_DIR), name="generated")
+# Mount static files; outputs of a generation run are cached forever, older names are revalidated.
+# Uploads are only served to their owner through GET /uploads/{file_id}, since blob names are content hashes.
+app.mount("/generated", CachedStaticFiles(directory=settings.GENERATED_DIR, immutable=is_run_scoped), name="generated")
 
 # Include routers
 app.include_router(auth.router)
@@ -42,6 +43,36 @@ async def vb_startup_check():
     except Exception as e:
         logging.getLogger("uvicorn.error").warning(f"Credits table check failed: {e}")
 
+@app.on_event("startup")
+async def vb_start_model_health():
+    from app.services.model_health import model_health
+    model_health.start()
+
+@app.on_event("startup")
+async def vb_start_job_workers():
+    from app.services.jobs import job_manager
+    job_manager.start()
+
+@app.on_event("startup")
+async def vb_start_upload_sweeper():
+    from app.services.upload_store import upload_sweeper
+    upload_sweeper.start()
+
+@app.on_event("shutdown")
+async def vb_shutdown():
+    from app.services.gemini_pool import gemini_pool
+    from app.services.model_health import model_health
+    from app.services.jobs import job_manager
+    from app.services.upload_store import upload_sweeper
+    from app.services.image_encoding import shutdown_encode_pool
+    from app.services.file_manager import file_manager
+    await job_manager.stop()
+    await upload_sweeper.stop()
+    await model_health.stop()
+    gemini_pool.close()
+    shutdown_encode_pool()
+    file_manager.close()
+
 @app.get("/")
 async def root():
     return {"message": "VibeBoost API is running"}
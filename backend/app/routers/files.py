@@ -1,19 +1,119 @@
-from fastapi import APIRouter, File, UploadFile, HTTPException, Depends
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, BackgroundTasks, File, UploadFile, HTTPException, Depends, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+import asyncio
+import base64
+import hashlib
+import json
+import mimetypes
 import os
 import uuid
-from typing import Dict, Any
+from pathlib import Path
+from typing import Dict, Any, Optional, Tuple
 
 from app.services.auth import get_current_user
 from app.services.file_manager import file_manager
 from app.services.credits import credit_manager
-from app.services.image_generator import generate_images
+from app.services.image_generator import generate_images, iter_generated_images
+from app.services.derivatives import derivative_cache
+from app.services.file_delivery import etag_matches, serve_file
+from app.services.image_encoding import pick_smallest_variant
+from app.services.image_output import FORMAT_EXTENSIONS, is_run_scoped
+from app.services.image_input import InvalidImageError, prepare_image
+from app.services.jobs import job_manager
+from app.services.model_health import ModelUnavailableError
+from app.services.storage import FileTooLargeError
+from app.services.upload_store import save_upload
 from app.core.config import settings
 
 router = APIRouter(tags=["files"])
 
+def _resolve_upload_path(upload: Dict[str, Any]):
+    # The record names the stored file: a content-addressed blob, or {file_id}{ext} for older uploads
+    path = settings.UPLOAD_DIR / upload["filename"]
+    return path if path.exists() else None
+
+def _prepare_generation(file_id: str, quantity: Optional[int], user_id: str):
+    """Check ownership and quantity, then pre-charge the credits for a generation.
+
+    Returns (upload, file_path, num_images, cost, credits remaining after the charge).
+    """
+    upload = file_manager.get_upload(file_id)
+    if not upload or upload["user_id"] != user_id:
+        raise HTTPException(status_code=403, detail="Access denied: You don't own this file")
+
+    file_path = _resolve_upload_path(upload)
+    if not file_path:
+        raise HTTPException(status_code=404, detail="File not found")
+
+    # Use quantity parameter or fall back to default NUM_IMAGES
+    num_images = quantity if quantity is not None else settings.NUM_IMAGES
+
+    # Validate quantity limits
+    if num_images < 1:
+        raise HTTPException(status_code=400, detail="Quantity must be at least 1")
+    if num_images > 100:  # Set reasonable upper limit
+        raise HTTPException(status_code=400, detail="Quantity cannot exceed 100")
+
+    # Determine and pre-charge credits; callers refund what they do not deliver
+    cost = num_images * settings.CREDIT_COST_PER_IMAGE
+    user_credits = credit_manager.get_credits(user_id)
+    if user_credits < cost:
+        raise HTTPException(status_code=402, detail="Insufficient credits")
+
+    remaining = credit_manager.consume_credits(user_id, cost)
+    return upload, file_path, num_images, cost, remaining
+
+def _owned_generated_file(filename: str, user_id: str) -> Dict[str, Any]:
+    """Look up a generated image by its master or delivery variant filename and check ownership"""
+    generated_file = file_manager.get_generated_file(filename)
+    if generated_file is None:
+        # Delivery variants are registered on their master, which shares the stem
+        stem = Path(filename).stem
+        for extension in set(FORMAT_EXTENSIONS.values()):
+            candidate = file_manager.get_generated_file(stem + extension)
+            if candidate and any(variant["filename"] == filename for variant in candidate.get("variants") or []):
+                generated_file = candidate
+                break
+    if not generated_file or not file_manager.user_owns_generated_file(generated_file["filename"], user_id):
+        raise HTTPException(status_code=403, detail="Access denied: You don't own this file")
+    return generated_file
+
+def _delivery_url(generated_file: Dict[str, Any]) -> str:
+    delivery = pick_smallest_variant(generated_file.get("variants")) or generated_file
+    return f"/generated/{delivery['filename']}"
+
+def _sse_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def _encode_cursor(created_at: str, item_id: str) -> str:
+    raw = json.dumps([created_at, item_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def _decode_cursor(cursor: Optional[str]) -> Optional[Tuple[str, str]]:
+    if not cursor:
+        return None
+    try:
+        created_at, item_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return str(created_at), str(item_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def _page_limit(limit: Optional[int]) -> int:
+    if limit is None:
+        return settings.HISTORY_PAGE_SIZE
+    if not 1 <= limit <= settings.HISTORY_MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"Limit must be between 1 and {settings.HISTORY_MAX_PAGE_SIZE}")
+    return limit
+
+def _history_etag(user_id: str) -> str:
+    # Scoped to the user so a cached page never validates for another account
+    version = file_manager.get_user_version(user_id)
+    return f'W/"{hashlib.sha256(f"{user_id}:{version}".encode()).hexdigest()[:16]}"'
+
+
 @router.post("/upload")
 async def upload_image(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...), 
     current_user: Dict[str, Any] = Depends(get_current_user)
 ):
@@ -26,116 +126,296 @@ async def upload_image(
     if file_extension not in settings.ALLOWED_EXTENSIONS:
         raise HTTPException(status_code=400, detail="File type not allowed")
     
-    filename = f"{file_id}{file_extension}"
-    file_path = settings.UPLOAD_DIR / filename
+    # Reject on the declared size before copying anything
+    if file.size is not None and file.size > settings.MAX_FILE_SIZE:
+        raise HTTPException(status_code=413, detail="File too large")
     
-    # Check file size
-    content = await file.read()
-    if len(content) > settings.MAX_FILE_SIZE:
+    # Copy in chunks, hashing as we go, and check the image header; identical content is stored once
+    try:
+        file_path, content_hash = await asyncio.to_thread(save_upload, file.file, file_extension, file.content_type)
+    except FileTooLargeError:
         raise HTTPException(status_code=413, detail="File too large")
+    except InvalidImageError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    filename = file_path.name
     
-    # Write file
-    with open(file_path, "wb") as buffer:
-        buffer.write(content)
+    # Register file with user; a blob left unreferenced by a failure here is reused or swept later.
+    # Metadata writes run off the event loop, since they can wait on another worker's write lock
+    await asyncio.to_thread(
+        file_manager.register_file, file_id, current_user["user_id"], filename, "upload", content_hash
+    )
     
-    # Register file with user
-    file_manager.register_file(file_id, current_user["user_id"], filename, "upload")
+    # Warm the normalized model input so the first /generate skips the resize
+    background_tasks.add_task(prepare_image, str(file_path))
     
     return {
         "file_id": file_id,
         "filename": filename,
-        "url": f"/uploads/{filename}",
+        "url": f"/uploads/{file_id}",
         "user_id": current_user["user_id"]
     }
 
-@router.post("/generate")
-async def generate_product_images(
+@router.get("/uploads/{file_id}")
+async def get_upload_file(
     file_id: str,
-    quantity: int = None,
+    request: Request,
     current_user: Dict[str, Any] = Depends(get_current_user)
 ):
-    # Check if user owns the file
-    if not file_manager.user_owns_file(file_id, current_user["user_id"]):
+    """Serve an upload to its owner; blobs are content-addressed, so they are never exposed by hash"""
+    upload = file_manager.get_upload(file_id)
+    if not upload or upload["user_id"] != current_user["user_id"]:
         raise HTTPException(status_code=403, detail="Access denied: You don't own this file")
-    
-    file_path = None
-    for ext in settings.ALLOWED_EXTENSIONS:
-        potential_path = settings.UPLOAD_DIR / f"{file_id}{ext}"
-        if potential_path.exists():
-            file_path = potential_path
-            break
-    
+
+    file_path = _resolve_upload_path(upload)
     if not file_path:
         raise HTTPException(status_code=404, detail="File not found")
-    
-    try:
-        # Use quantity parameter or fall back to default NUM_IMAGES
-        num_images = quantity if quantity is not None else settings.NUM_IMAGES
 
-        # Validate quantity limits
-        if num_images < 1:
-            raise HTTPException(status_code=400, detail="Quantity must be at least 1")
-        if num_images > 100:  # Set reasonable upper limit
-            raise HTTPException(status_code=400, detail="Quantity cannot exceed 100")
+    return serve_file(request.headers, file_path, media_type=mimetypes.guess_type(file_path.name)[0])
 
-        # Determine and pre-charge credits immediately
-        cost = num_images * settings.CREDIT_COST_PER_IMAGE
-        user_credits = credit_manager.get_credits(current_user["user_id"])
-        if user_credits < cost:
-            raise HTTPException(status_code=402, detail="Insufficient credits")
-
-        # Deduct up front; will refund on failure
-        remaining_after_charge = credit_manager.consume_credits(current_user["user_id"], cost)
+@router.post("/generate")
+async def generate_product_images(
+    file_id: str,
+    quantity: int = None,
+    current_user: Dict[str, Any] = Depends(get_current_user)
+):
+    user_id = current_user["user_id"]
+    upload, file_path, num_images, cost, remaining_after_charge = _prepare_generation(file_id, quantity, user_id)
 
-        generated_images = await generate_images(str(file_path), file_id, num_images)
+    try:
+        generated_images = await generate_images(
+            str(file_path), file_id, num_images, user_id, upload.get("content_hash")
+        )
         
         # Register generated files
-        for image_info in generated_images:
-            if "filename" in image_info:
-                file_manager.add_generated_file(file_id, image_info["filename"])
+        await asyncio.to_thread(file_manager.add_generated_files, file_id, generated_images)
         
         return {
             "file_id": file_id,
             "generated_images": generated_images,
-            "user_id": current_user["user_id"],
+            "user_id": user_id,
             "credits": remaining_after_charge
         }
     except Exception as e:
         # Refund on failure
         try:
-            credit_manager.add_credits(current_user["user_id"], cost)
+            credit_manager.add_credits(user_id, cost)
         except Exception:
             pass
+        if isinstance(e, ModelUnavailableError):
+            raise HTTPException(
+                status_code=503, detail=str(e),
+                headers={"Retry-After": str(int(settings.MODEL_HEALTH_RESET_TIMEOUT))}
+            )
         raise HTTPException(status_code=500, detail=f"Generation failed: {str(e)}")
 
+@router.post("/generate/stream")
+async def generate_product_images_stream(
+    file_id: str,
+    quantity: int = None,
+    current_user: Dict[str, Any] = Depends(get_current_user)
+):
+    """Stream generated images as Server-Sent Events as soon as each one is saved"""
+    user_id = current_user["user_id"]
+    upload, file_path, num_images, cost, remaining_after_charge = _prepare_generation(file_id, quantity, user_id)
+
+    async def event_stream():
+        generated_count = 0
+        error = None
+        remaining = remaining_after_charge
+        try:
+            try:
+                async for image_info in iter_generated_images(
+                    str(file_path), file_id, num_images, user_id, upload.get("content_hash")
+                ):
+                    # Register before the client sees it, so /download and /images accept it right away
+                    await asyncio.to_thread(file_manager.add_generated_files, file_id, [image_info])
+                    generated_count += 1
+                    yield _sse_event("image", image_info)
+            except Exception as e:
+                error = e
+        finally:
+            # Refund the images that were not delivered, whether generation failed, came up
+            # short or the client disconnected and cancelled the rest
+            if generated_count < num_images:
+                refund = (num_images - generated_count) * settings.CREDIT_COST_PER_IMAGE
+                try:
+                    remaining = credit_manager.add_credits(user_id, refund)
+                except Exception:
+                    pass
+
+        if error is not None:
+            yield _sse_event("error", {"detail": f"Generation failed: {str(error)}", "credits": remaining})
+            return
+
+        yield _sse_event("summary", {
+            "file_id": file_id,
+            "generated_count": generated_count,
+            "user_id": user_id,
+            "credits": remaining
+        })
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.post("/jobs", status_code=202)
+async def create_generation_job(
+    file_id: str,
+    quantity: int = None,
+    current_user: Dict[str, Any] = Depends(get_current_user)
+):
+    """Queue a generation job and return its id immediately"""
+    user_id = current_user["user_id"]
+    # The worker refunds what it cannot deliver
+    upload, file_path, num_images, cost, remaining_after_charge = _prepare_generation(file_id, quantity, user_id)
+
+    job = job_manager.submit(user_id, file_id, str(file_path), num_images, cost)
+
+    return {
+        "job_id": job["job_id"],
+        "file_id": file_id,
+        "status": job["status"],
+        "user_id": user_id,
+        "credits": remaining_after_charge
+    }
+
+@router.get("/jobs/{job_id}")
+async def get_generation_job(
+    job_id: str,
+    current_user: Dict[str, Any] = Depends(get_current_user)
+):
+    job = job_manager.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["user_id"] != current_user["user_id"]:
+        raise HTTPException(status_code=403, detail="Access denied: You don't own this job")
+
+    return {
+        "job_id": job["job_id"],
+        "file_id": job["file_id"],
+        "status": job["status"],
+        "requested": job["num_images"],
+        "completed": len(job["images"]),
+        "generated_images": job["images"],
+        "refunded": job["refunded"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"]
+    }
+
 @router.get("/download/{filename}")
 async def download_file(
     filename: str, 
+    request: Request,
+    original: bool = False,
     current_user: Dict[str, Any] = Depends(get_current_user)
 ):
     # Check if user owns the generated file
-    if not file_manager.user_owns_generated_file(filename, current_user["user_id"]):
-        raise HTTPException(status_code=403, detail="Access denied: You don't own this file")
+    generated_file = _owned_generated_file(filename, current_user["user_id"])
+    
+    # Serve the smallest recorded variant unless the master is explicitly requested
+    if original:
+        filename = generated_file["filename"]
+    else:
+        delivery = pick_smallest_variant(generated_file.get("variants"))
+        if delivery and (settings.GENERATED_DIR / delivery["filename"]).exists():
+            filename = delivery["filename"]
     
     file_path = settings.GENERATED_DIR / filename
     if not file_path.exists():
         raise HTTPException(status_code=404, detail="File not found")
     
-    return FileResponse(
-        path=file_path,
-        filename=filename,
-        media_type='application/octet-stream'
+    return serve_file(
+        request.headers, file_path,
+        media_type='application/octet-stream', download_name=filename, accel_path=filename,
+        immutable=is_run_scoped(filename)
     )
 
+@router.get("/images/{filename}")
+async def get_resized_image(
+    filename: str,
+    request: Request,
+    w: int = None,
+    h: int = None,
+    fmt: str = "webp",
+    current_user: Dict[str, Any] = Depends(get_current_user)
+):
+    """Serve a generated image resized to fit within w x h, cached on disk after the first request"""
+    # Derivatives are always rendered from the master, whichever variant was named
+    filename = _owned_generated_file(filename, current_user["user_id"])["filename"]
+
+    fmt = fmt.upper()
+    if fmt == "JPG":
+        fmt = "JPEG"
+    if fmt not in FORMAT_EXTENSIONS:
+        raise HTTPException(status_code=400, detail="Unsupported format")
+    for size in (w, h):
+        if size is not None and not 1 <= size <= settings.DERIVATIVE_MAX_EDGE:
+            raise HTTPException(status_code=400, detail=f"Size must be between 1 and {settings.DERIVATIVE_MAX_EDGE}")
+
+    if not (settings.GENERATED_DIR / filename).exists():
+        raise HTTPException(status_code=404, detail="File not found")
+
+    # Derivatives can be evicted and re-rendered under the same name, so they are revalidated;
+    # one eviction between lookup and serve just renders the derivative again
+    for _ in range(2):
+        path = await derivative_cache.get(filename, w, h, fmt)
+        try:
+            return serve_file(request.headers, path, media_type=f"image/{fmt.lower()}", immutable=False)
+        except FileNotFoundError:
+            continue
+    raise HTTPException(status_code=404, detail="File not found")
+
 @router.get("/files")
-async def get_user_files(current_user: Dict[str, Any] = Depends(get_current_user)):
-    user_files = file_manager.get_user_files(current_user["user_id"])
-    return {"files": user_files}
+async def get_user_files(
+    request: Request,
+    limit: int = None,
+    cursor: str = None,
+    current_user: Dict[str, Any] = Depends(get_current_user)
+):
+    """Page through the user's uploads oldest first; pass next_cursor back to get the following page"""
+    user_id = current_user["user_id"]
+    limit = _page_limit(limit)
+    after = _decode_cursor(cursor)
+
+    # Read the version before the data: if a write lands in between, the next request just sees a new ETag
+    etag = _history_etag(user_id)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    user_files = file_manager.get_user_files(user_id, limit + 1, after)
+    next_cursor = None
+    if len(user_files) > limit:
+        user_files = user_files[:limit]
+        next_cursor = _encode_cursor(user_files[-1]["created_at"], user_files[-1]["file_id"])
+    return JSONResponse({"files": user_files, "next_cursor": next_cursor}, headers=headers)
 
 @router.get("/generations")
-async def get_user_generations(current_user: Dict[str, Any] = Depends(get_current_user)):
-    generations = file_manager.get_user_generations(current_user["user_id"])
-    return {"generations": generations}
+async def get_user_generations(
+    request: Request,
+    limit: int = None,
+    cursor: str = None,
+    current_user: Dict[str, Any] = Depends(get_current_user)
+):
+    """Page through the user's generations newest first; pass next_cursor back to get older ones"""
+    user_id = current_user["user_id"]
+    limit = _page_limit(limit)
+    before = _decode_cursor(cursor)
+
+    etag = _history_etag(user_id)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    generations = file_manager.get_user_generations(user_id, limit + 1, before)
+    next_cursor = None
+    if len(generations) > limit:
+        generations = generations[:limit]
+        next_cursor = _encode_cursor(generations[-1]["created_at"], generations[-1]["generation_id"])
+    return JSONResponse({"generations": generations, "next_cursor": next_cursor}, headers=headers)
 
 @router.post("/generate-similar")
 async def generate_similar_images(
@@ -193,16 +473,18 @@ async def generate_similar_images(
         # In a real implementation, you'd download the reference image and use it
         generated_images = []
         for i in range(num_images):
-            generated_images.append({
+            image_info = {
                 "filename": f"{similar_file_id}_similar_{i+1}.png",
                 "url": f"/generated/{similar_file_id}_similar_{i+1}.png",
-                "style": style or f"style_{i+1}",
                 "description": f"{base_prompt} - Variation {i+1}"
-            })
+            }
+            # Only the style the caller asked for; never a positional placeholder
+            if style:
+                image_info["style"] = style
+            generated_images.append(image_info)
 
         # Register generated files with file manager
-        for image_info in generated_images:
-            file_manager.add_generated_file(similar_file_id, image_info["filename"])
+        await asyncio.to_thread(file_manager.add_generated_files, similar_file_id, generated_images)
 
         return {
             "file_id": similar_file_id,
@@ -223,33 +505,39 @@ async def generate_similar_images(
 @router.get("/generation/{generation_id}")
 async def get_generation_details(
     generation_id: str,
+    request: Request,
     current_user: Dict[str, Any] = Depends(get_current_user)
 ):
+    generation = file_manager.get_generation(generation_id)
+
     # Check if user owns the generation
-    if not file_manager.user_owns_file(generation_id, current_user["user_id"]):
+    if not generation or generation["user_id"] != current_user["user_id"]:
         raise HTTPException(status_code=403, detail="Access denied: You don't own this generation")
 
-    # Get the generation data
-    user_files = file_manager.get_user_files(current_user["user_id"])
-    generation = next((f for f in user_files if f["file_id"] == generation_id), None)
-
-    if not generation:
-        raise HTTPException(status_code=404, detail="Generation not found")
+    # Images are only ever appended, so the count identifies the manifest's content
+    etag = f'"{generation_id}-{len(generation["generated_files"])}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
 
     # Transform generated files to include full URLs
     generated_images = []
-    for gen_file in generation.get("generated_files", []):
-        generated_images.append({
+    for gen_file in generation["generated_files"]:
+        image_info = {
             "filename": gen_file["filename"],
-            "url": f"/generated/{gen_file['filename']}",
+            "url": _delivery_url(gen_file),
             "created_at": gen_file["created_at"],
-            "style": f"style_{len(generated_images) + 1}",  # Generate style names
-            "description": f"AI-generated variation of {generation['filename']}"
-        })
+            "description": gen_file.get("description") or f"AI-generated variation of {generation['filename']}",
+            "thumbnail_url": gen_file.get("thumbnail_url"),
+            "placeholder": gen_file.get("placeholder")
+        }
+        if gen_file.get("style"):
+            image_info["style"] = gen_file["style"]
+        generated_images.append(image_info)
 
-    return {
+    return JSONResponse({
         "generation_id": generation_id,
         "original_filename": generation["filename"],
         "created_at": generation["created_at"],
         "generated_images": generated_images
-    }
+    }, headers=headers)
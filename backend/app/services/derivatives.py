@@ -0,0 +1,107 @@
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional
+
+from app.core.config import settings
+from app.services.image_encoding import render_derivative, run_in_encode_pool
+from app.services.image_output import FORMAT_EXTENSIONS
+
+
+class DerivativeCache:
+    """On-disk cache of resized copies of generated images.
+
+    Each (image, width, height, format) is rendered once in the encoding
+    process pool and then served straight from ``cache_dir``. Hits refresh the
+    file's position in an LRU list, and the least recently used derivatives
+    are deleted once the directory grows past ``max_bytes``. Recency is kept
+    in the access time so the modification time, and with it the ETag, only
+    changes when a derivative is rendered again.
+    """
+
+    def __init__(self, cache_dir: Path = None, max_bytes: int = None):
+        self.cache_dir = Path(cache_dir or settings.DERIVATIVE_DIR)
+        self.max_bytes = max_bytes or settings.DERIVATIVE_CACHE_MAX_BYTES
+        self._entries: Optional["OrderedDict[str, int]"] = None
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._renders: Dict[str, asyncio.Future] = {}
+
+    def _load_entries(self):
+        # Rebuild the LRU order from disk once, least recently used first
+        if self._entries is not None:
+            return
+        files = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and not entry.name.startswith("."):
+                stat = entry.stat()
+                files.append((max(stat.st_atime, stat.st_mtime), entry.name, stat.st_size))
+        files.sort()
+        self._entries = OrderedDict((name, size) for _, name, size in files)
+        self._total_bytes = sum(self._entries.values())
+
+    def path_for(self, filename: str, width: Optional[int], height: Optional[int], fmt: str) -> Path:
+        stem = Path(filename).stem
+        return self.cache_dir / f"{stem}_{width or 0}x{height or 0}{FORMAT_EXTENSIONS[fmt]}"
+
+    def _touch(self, path: Path) -> bool:
+        with self._lock:
+            self._load_entries()
+            if path.name not in self._entries:
+                # Possibly rendered by another worker process
+                if not path.exists():
+                    return False
+                size = path.stat().st_size
+                self._entries[path.name] = size
+                self._total_bytes += size
+            elif not path.exists():
+                self._total_bytes -= self._entries.pop(path.name)
+                return False
+            self._entries.move_to_end(path.name)
+        try:
+            os.utime(path, ns=(time.time_ns(), path.stat().st_mtime_ns))
+        except OSError:
+            pass
+        return True
+
+    def _add(self, path: Path, size: int):
+        with self._lock:
+            self._load_entries()
+            self._total_bytes += size - self._entries.pop(path.name, 0)
+            self._entries[path.name] = size
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                name, evicted_size = self._entries.popitem(last=False)
+                self._total_bytes -= evicted_size
+                try:
+                    os.unlink(self.cache_dir / name)
+                except OSError:
+                    pass
+
+    async def get(self, filename: str, width: Optional[int], height: Optional[int], fmt: str) -> Path:
+        """Return the path of the derivative, rendering it on first request"""
+        path = self.path_for(filename, width, height, fmt)
+        if self._touch(path):
+            return path
+
+        # Concurrent requests for the same derivative share a single render
+        render = self._renders.get(path.name)
+        if render is None:
+            source = settings.GENERATED_DIR / filename
+            render = asyncio.ensure_future(run_in_encode_pool(
+                render_derivative, str(source), str(path), width, height, fmt, settings.DERIVATIVE_QUALITY
+            ))
+            self._renders[path.name] = render
+            try:
+                size = await asyncio.shield(render)
+                self._add(path, size)
+            finally:
+                self._renders.pop(path.name, None)
+        else:
+            await render
+        return path
+
+
+derivative_cache = DerivativeCache()
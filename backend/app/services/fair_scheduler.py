@@ -0,0 +1,132 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Optional, Tuple
+
+from app.core.config import settings
+from app.services.credits import credit_manager
+
+
+def plan_weight(plan_id: str) -> int:
+    plan = settings.SUBSCRIPTION_PLANS.get(plan_id) or settings.SUBSCRIPTION_PLANS["free"]
+    return max(1, int(plan.get("priority_weight", 1)))
+
+
+class _UserQueue:
+    def __init__(self, weight: int):
+        self.weight = weight
+        self.in_flight = 0
+        self.virtual_time = 0.0
+        self.waiters: Deque[asyncio.Future] = deque()
+
+
+class FairShareScheduler:
+    """Weighted fair queuing of image generation calls across users.
+
+    Each user gets their own queue. Whenever a slot frees up it goes to the
+    waiting user with the lowest virtual time, and serving a call advances
+    that user's virtual time by ``1 / weight``, so a Business user with weight
+    8 gets eight calls for every call of a free user while both are busy.
+    No user may hold more than ``max_in_flight_per_user`` slots, which keeps a
+    single bulk request from occupying the whole model quota.
+    """
+
+    def __init__(self, capacity: int = None, max_in_flight_per_user: int = None, plan_cache_ttl: float = 60.0):
+        self.capacity = max(1, capacity or settings.FAIR_SHARE_CAPACITY or settings.GEMINI_MAX_CONCURRENCY)
+        self.max_in_flight_per_user = max(1, max_in_flight_per_user or settings.FAIR_SHARE_MAX_IN_FLIGHT_PER_USER)
+        self.plan_cache_ttl = plan_cache_ttl
+        self._in_flight = 0
+        self._virtual_time = 0.0
+        self._users: Dict[str, _UserQueue] = {}
+        self._plan_cache: Dict[str, Tuple[int, float]] = {}
+        self._plan_cache_pruned = time.monotonic()
+
+    async def weight_for(self, user_id: Optional[str]) -> int:
+        """Look up the user's plan weight, cached briefly to keep Supabase off the hot path"""
+        if not user_id:
+            return 1
+        cached = self._plan_cache.get(user_id)
+        if cached and time.monotonic() - cached[1] < self.plan_cache_ttl:
+            return cached[0]
+        plan_id = await asyncio.to_thread(credit_manager.get_user_plan, user_id)
+        weight = plan_weight(plan_id)
+        now = time.monotonic()
+        # Drop expired entries at most once per TTL so users who went idle do not accumulate
+        if now - self._plan_cache_pruned >= self.plan_cache_ttl:
+            self._plan_cache = {
+                cached_user: entry for cached_user, entry in self._plan_cache.items()
+                if now - entry[1] < self.plan_cache_ttl
+            }
+            self._plan_cache_pruned = now
+        self._plan_cache[user_id] = (weight, now)
+        return weight
+
+    def _grant(self, user_id: str, queue: _UserQueue):
+        # Idle users rejoin at the current virtual time instead of banking credit
+        queue.virtual_time = max(queue.virtual_time, self._virtual_time) + 1.0 / queue.weight
+        queue.in_flight += 1
+        self._in_flight += 1
+
+    def _dispatch(self):
+        while self._in_flight < self.capacity:
+            candidates = [
+                (queue.virtual_time, user_id, queue)
+                for user_id, queue in self._users.items()
+                if queue.waiters and queue.in_flight < self.max_in_flight_per_user
+            ]
+            if not candidates:
+                return
+            _, user_id, queue = min(candidates, key=lambda c: c[0])
+            self._virtual_time = max(self._virtual_time, queue.virtual_time)
+            waiter = queue.waiters.popleft()
+            self._grant(user_id, queue)
+            waiter.set_result(None)
+
+    def _release(self, user_id: str):
+        queue = self._users[user_id]
+        queue.in_flight -= 1
+        self._in_flight -= 1
+        if queue.in_flight == 0 and not queue.waiters:
+            del self._users[user_id]
+        self._dispatch()
+
+    async def acquire(self, user_id: str, weight: int = 1):
+        queue = self._users.get(user_id)
+        if queue is None:
+            queue = self._users[user_id] = _UserQueue(weight)
+        queue.weight = weight
+
+        if (
+            self._in_flight < self.capacity
+            and queue.in_flight < self.max_in_flight_per_user
+            and not any(q.waiters for q in self._users.values())
+        ):
+            self._grant(user_id, queue)
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        queue.waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was granted just as we were cancelled; hand it on
+                self._release(user_id)
+            else:
+                queue.waiters.remove(waiter)
+                if queue.in_flight == 0 and not queue.waiters:
+                    self._users.pop(user_id, None)
+            raise
+
+    @asynccontextmanager
+    async def slot(self, user_id: Optional[str], weight: int = 1):
+        user_id = user_id or ""
+        await self.acquire(user_id, weight)
+        try:
+            yield
+        finally:
+            self._release(user_id)
+
+
+fair_scheduler = FairShareScheduler()
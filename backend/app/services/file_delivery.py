@@ -0,0 +1,100 @@
+import os
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+
+from app.core.config import settings
+
+
+def file_etag(stat_result: os.stat_result) -> str:
+    # Files are written once via temp-file rename, so mtime and size identify the content
+    return f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+
+
+def cache_headers(stat_result: os.stat_result, scope: str = "public", immutable: bool = True) -> Dict[str, str]:
+    """Cache forever only when the file is never rewritten; otherwise revalidate against the ETag"""
+    if immutable:
+        cache_control = f"{scope}, max-age={settings.IMMUTABLE_MAX_AGE}, immutable"
+    else:
+        cache_control = f"{scope}, no-cache"
+    return {"ETag": file_etag(stat_result), "Cache-Control": cache_control}
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match check; weak comparison, as RFC 9110 requires for this header"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag.removeprefix("W/") in candidates
+
+
+class DeliveryFileResponse(FileResponse):
+    """FileResponse with larger reads for the fallback copy loop.
+
+    Starlette already answers Range/If-Range requests, and hands the path to
+    the server when it supports the ``http.response.pathsend`` extension, so
+    the body goes out zero-copy there; otherwise it is streamed in chunks.
+    """
+    chunk_size = 1024 * 1024
+
+
+class CachedStaticFiles(StaticFiles):
+    """StaticFiles with strong ETags and a per-file caching policy.
+
+    Files for which ``immutable(filename)`` holds are never rewritten, so they
+    get a year-long immutable Cache-Control and browsers and CDNs never
+    revalidate them. Everything else is revalidated on each use. Either way a
+    matching If-None-Match gets a 304.
+    """
+
+    def __init__(self, *args, immutable: Callable[[str], bool] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.immutable = immutable or (lambda filename: False)
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope: Scope, status_code: int = 200) -> Response:
+        request_headers = Headers(scope=scope)
+        headers = cache_headers(stat_result, immutable=self.immutable(os.path.basename(full_path)))
+        response = DeliveryFileResponse(
+            full_path, status_code=status_code, stat_result=stat_result, headers=headers
+        )
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+def serve_file(
+    request_headers: Headers,
+    path: Path,
+    media_type: Optional[str] = None,
+    download_name: Optional[str] = None,
+    accel_path: Optional[str] = None,
+    immutable: bool = True
+) -> Response:
+    """Serve a file from an authenticated endpoint.
+
+    Answers If-None-Match with 304; pass ``immutable=False`` for files that
+    can be rewritten under the same name. When ACCEL_REDIRECT_PREFIX is set
+    and ``accel_path`` is given, the body is left to the fronting nginx
+    through X-Accel-Redirect, which sends it with sendfile and handles Range
+    itself. Raises FileNotFoundError if the file has gone away.
+    """
+    stat_result = path.stat()
+    headers = cache_headers(stat_result, "private", immutable)
+    if etag_matches(request_headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+
+    if settings.ACCEL_REDIRECT_PREFIX and accel_path:
+        headers["X-Accel-Redirect"] = f"{settings.ACCEL_REDIRECT_PREFIX.rstrip('/')}/{accel_path}"
+        if download_name:
+            headers["Content-Disposition"] = f'attachment; filename="{download_name}"'
+        return Response(status_code=200, headers=headers, media_type=media_type)
+
+    return DeliveryFileResponse(
+        path, filename=download_name, media_type=media_type, stat_result=stat_result, headers=headers
+    )
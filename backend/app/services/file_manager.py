@@ -1,70 +1,373 @@
+import bisect
 import json
 import os
+import threading
+import time
+import uuid
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from app.core.config import settings
+from app.services.storage import write_atomic
+
+def _read_journal(journal_file: Path) -> List[Dict]:
+    records = []
+    if not journal_file.exists():
+        return records
+    with open(journal_file, 'r') as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                # A torn final line from a crash mid-append; everything before it is intact
+                break
+    return records
+
+def _replay(metadata: Dict, record: Dict):
+    """Apply one journal record; replaying a record twice leaves the same state"""
+    if record["op"] == "register_file":
+        metadata[record["file_id"]] = record["file_info"]
+    elif record["op"] in ("add_generated_file", "add_generated_files"):
+        file_info = metadata.get(record["file_id"])
+        if file_info is None:
+            return
+        for generated_file in record.get("generated_files") or [record["generated_file"]]:
+            if generated_file not in file_info["generated_files"]:
+                file_info["generated_files"].append(generated_file)
+
+def load_json_metadata(metadata_file: Path) -> Dict:
+    """Read the snapshot and replay any journals written since it was taken"""
+    metadata = {}
+    if metadata_file.exists():
+        try:
+            with open(metadata_file, 'r') as f:
+                metadata = json.load(f)
+        except (json.JSONDecodeError, IOError):
+            metadata = {}
+    for journal_file in (_compacting_journal_path(metadata_file), _journal_path(metadata_file)):
+        for record in _read_journal(journal_file):
+            _replay(metadata, record)
+    return metadata
+
+def _truncate_torn_tail(journal_file: Path):
+    """Drop a partial last line so new appends do not get glued onto it"""
+    if not journal_file.exists():
+        return
+    with open(journal_file, 'rb+') as f:
+        data = f.read()
+        if data and not data.endswith(b"\n"):
+            f.truncate(data.rfind(b"\n") + 1)
+
+def _journal_path(metadata_file: Path) -> Path:
+    return metadata_file.with_name(metadata_file.name + ".journal")
+
+def _compacting_journal_path(metadata_file: Path) -> Path:
+    return metadata_file.with_name(metadata_file.name + ".journal.compacting")
+
 class FileManager:
+    """File metadata kept in memory and persisted as a JSON snapshot plus an append-only journal.
+
+    Every mutation appends one JSON line to ``<metadata_file>.journal``;
+    fsyncs are batched to at most one per METADATA_JOURNAL_FSYNC_INTERVAL.
+    A background thread compacts the journal into a new snapshot (written
+    to a temp file and renamed into place) once it grows past
+    METADATA_JOURNAL_COMPACT_BYTES, so write cost does not depend on how
+    many files are stored.
+
+    The store is single-process: each instance holds the whole state in
+    memory, so it takes an exclusive lock on ``<metadata_file>.lock`` and a
+    second process fails fast instead of silently losing updates. Use the
+    SQLite backend to run several workers. Writes may come from worker
+    threads, so they are serialized by a lock.
+    """
+
     def __init__(self, metadata_file: str = "file_metadata.json"):
         self.metadata_file = Path(metadata_file)
+        self.journal_file = _journal_path(self.metadata_file)
+        self._lock_file = self._acquire_process_lock()
         self.metadata = self._load_metadata()
+        self._build_indexes()
+        # Versions restart from zero in every process, so the epoch keeps them from repeating across restarts
+        self._version_epoch = uuid.uuid4().hex[:8]
+        self._user_versions: Dict[str, int] = {}
+
+        self._write_lock = threading.Lock()
+        self._journal_lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+        _truncate_torn_tail(self.journal_file)
+        self._journal = open(self.journal_file, 'a')
+        self._dirty = False
+        self._last_fsync = time.monotonic()
+        self._closed = threading.Event()
+        self._background = threading.Thread(target=self._background_loop, name="file-metadata-journal", daemon=True)
+        self._background.start()
+    
+    def _acquire_process_lock(self):
+        if fcntl is None:
+            return None
+        lock_file = open(self.metadata_file.with_name(self.metadata_file.name + ".lock"), 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            raise RuntimeError(
+                f"{self.metadata_file} is in use by another process; "
+                "set METADATA_BACKEND=sqlite to run multiple workers"
+            )
+        return lock_file
     
     def _load_metadata(self) -> Dict:
-        if self.metadata_file.exists():
-            try:
-                with open(self.metadata_file, 'r') as f:
-                    return json.load(f)
-            except (json.JSONDecodeError, IOError):
-                return {}
-        return {}
+        return load_json_metadata(self.metadata_file)
     
-    def _save_metadata(self):
+    def _fsync_journal(self):
+        # Caller holds _journal_lock
         try:
-            with open(self.metadata_file, 'w') as f:
-                json.dump(self.metadata, f, indent=2)
-        except IOError:
+            os.fsync(self._journal.fileno())
+        except (OSError, ValueError):
             pass
+        self._dirty = False
+        self._last_fsync = time.monotonic()
     
-    def register_file(self, file_id: str, user_id: str, filename: str, file_type: str = "upload"):
-        self.metadata[file_id] = {
+    def _append_journal(self, record: Dict):
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self._journal_lock:
+            try:
+                self._journal.write(line)
+                self._journal.flush()
+            except (IOError, ValueError):
+                return
+            self._dirty = True
+            if time.monotonic() - self._last_fsync >= settings.METADATA_JOURNAL_FSYNC_INTERVAL:
+                self._fsync_journal()
+    
+    def _background_loop(self):
+        interval = max(0.01, settings.METADATA_JOURNAL_FSYNC_INTERVAL)
+        while not self._closed.wait(interval):
+            with self._journal_lock:
+                if self._dirty:
+                    self._fsync_journal()
+            try:
+                if self.journal_file.stat().st_size >= settings.METADATA_JOURNAL_COMPACT_BYTES:
+                    self.compact()
+            except OSError:
+                pass
+    
+    def compact(self):
+        """Fold the journal into a fresh snapshot.
+
+        The live journal is first renamed aside so writers keep appending to a
+        new one; the snapshot is then rebuilt from disk (old snapshot plus the
+        renamed journal), so this never has to serialize the in-memory dict
+        while requests are mutating it. A crash at any point leaves a state
+        that load_json_metadata replays to the same result.
+        """
+        with self._compact_lock:
+            compacting_file = _compacting_journal_path(self.metadata_file)
+            if not compacting_file.exists():
+                with self._journal_lock:
+                    if self.journal_file.stat().st_size == 0:
+                        return
+                    self._fsync_journal()
+                    self._journal.close()
+                    os.replace(self.journal_file, compacting_file)
+                    self._journal = open(self.journal_file, 'a')
+
+            snapshot = {}
+            if self.metadata_file.exists():
+                try:
+                    with open(self.metadata_file, 'r') as f:
+                        snapshot = json.load(f)
+                except (json.JSONDecodeError, IOError):
+                    snapshot = {}
+            for record in _read_journal(compacting_file):
+                _replay(snapshot, record)
+            write_atomic(self.metadata_file, json.dumps(snapshot).encode(), fsync=True)
+            os.unlink(compacting_file)
+    
+    def close(self):
+        self._closed.set()
+        with self._journal_lock:
+            if not self._journal.closed:
+                self._fsync_journal()
+                self._journal.close()
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+    
+    def _build_indexes(self):
+        """Secondary indexes over self.metadata, kept in sync by every mutation.
+
+        _user_files maps user_id to that user's file_ids ordered by
+        (created_at, file_id), _generated_owner maps a generated filename to
+        the file_id it belongs to and _content_refs counts the uploads that
+        point at each content-addressed blob.
+        """
+        self._user_files: Dict[str, List[str]] = {}
+        self._generated_owner: Dict[str, str] = {}
+        self._content_refs: Dict[str, int] = {}
+        for file_id in sorted(self.metadata, key=self._sort_key):
+            file_info = self.metadata[file_id]
+            self._user_files.setdefault(file_info["user_id"], []).append(file_id)
+            if file_info.get("content_hash"):
+                self._content_refs[file_info["content_hash"]] = self._content_refs.get(file_info["content_hash"], 0) + 1
+            for generated_file in file_info.get("generated_files", []):
+                self._generated_owner.setdefault(generated_file["filename"], file_id)
+    
+    def _sort_key(self, file_id: str) -> Tuple[str, str]:
+        return (self.metadata[file_id]["created_at"], file_id)
+    
+    def _bump_version(self, user_id: str):
+        self._user_versions[user_id] = self._user_versions.get(user_id, 0) + 1
+    
+    def get_user_version(self, user_id: str) -> str:
+        """Opaque token that changes whenever the user's files or generations change"""
+        return f"{self._version_epoch}.{self._user_versions.get(user_id, 0)}"
+    
+    def _unindex_file(self, file_id: str):
+        file_info = self.metadata.get(file_id)
+        if not file_info:
+            return
+        if file_info.get("content_hash"):
+            self._content_refs[file_info["content_hash"]] -= 1
+            if not self._content_refs[file_info["content_hash"]]:
+                del self._content_refs[file_info["content_hash"]]
+        user_file_ids = self._user_files.get(file_info["user_id"], [])
+        if file_id in user_file_ids:
+            user_file_ids.remove(file_id)
+        for generated_file in file_info.get("generated_files", []):
+            if self._generated_owner.get(generated_file["filename"]) == file_id:
+                del self._generated_owner[generated_file["filename"]]
+    
+    def register_file(
+        self, file_id: str, user_id: str, filename: str, file_type: str = "upload", content_hash: Optional[str] = None
+    ):
+        """Record an upload; ``filename`` is the stored file in UPLOAD_DIR, ``content_hash`` its SHA-256 blob key"""
+        file_info = {
             "user_id": user_id,
             "filename": filename,
             "file_type": file_type,
             "created_at": datetime.utcnow().isoformat(),
             "generated_files": []
         }
-        self._save_metadata()
+        if content_hash:
+            file_info["content_hash"] = content_hash
+        with self._write_lock:
+            previous_owner = self.get_file_owner(file_id)
+            self._unindex_file(file_id)
+            self._append_journal({"op": "register_file", "file_id": file_id, "file_info": file_info})
+            self.metadata[file_id] = file_info
+            if content_hash:
+                self._content_refs[content_hash] = self._content_refs.get(content_hash, 0) + 1
+            bisect.insort(self._user_files.setdefault(user_id, []), file_id, key=self._sort_key)
+            self._bump_version(user_id)
+            if previous_owner and previous_owner != user_id:
+                self._bump_version(previous_owner)
     
-    def add_generated_file(self, original_file_id: str, generated_filename: str):
-        if original_file_id in self.metadata:
-            self.metadata[original_file_id]["generated_files"].append({
-                "filename": generated_filename,
-                "created_at": datetime.utcnow().isoformat()
+    def add_generated_files(self, original_file_id: str, images: List[Dict]):
+        """Register several generated images of one upload with a single journal write.
+
+        ``images`` are the dicts produced by the generator: ``filename`` plus
+        optional ``variants``, ``thumbnail_url``, ``placeholder``, ``style`` and
+        the prompt in ``description``. Entries
+        without a filename are skipped, as is everything when the upload is unknown.
+        """
+        created_at = datetime.utcnow().isoformat()
+        generated_files = []
+        for image_info in images:
+            if not image_info.get("filename"):
+                continue
+            generated_file = {"filename": image_info["filename"], "created_at": created_at}
+            for key in ("variants", "thumbnail_url", "placeholder", "style", "description"):
+                if image_info.get(key):
+                    generated_file[key] = image_info[key]
+            generated_files.append(generated_file)
+        if not generated_files:
+            return
+
+        with self._write_lock:
+            if original_file_id not in self.metadata:
+                return
+            self._append_journal({
+                "op": "add_generated_files", "file_id": original_file_id, "generated_files": generated_files
             })
-            self._save_metadata()
+            self.metadata[original_file_id]["generated_files"].extend(generated_files)
+            for generated_file in generated_files:
+                self._generated_owner.setdefault(generated_file["filename"], original_file_id)
+            self._bump_version(self.metadata[original_file_id]["user_id"])
+    
+    def add_generated_file(
+        self,
+        original_file_id: str,
+        generated_filename: str,
+        variants: Optional[List[Dict]] = None,
+        thumbnail_url: Optional[str] = None,
+        placeholder: Optional[str] = None
+    ):
+        self.add_generated_files(original_file_id, [{
+            "filename": generated_filename,
+            "variants": variants,
+            "thumbnail_url": thumbnail_url,
+            "placeholder": placeholder
+        }])
     
     def get_file_owner(self, file_id: str) -> Optional[str]:
         file_info = self.metadata.get(file_id)
         return file_info["user_id"] if file_info else None
     
-    def get_user_files(self, user_id: str) -> List[Dict]:
-        user_files = []
-        for file_id, file_info in self.metadata.items():
-            if file_info["user_id"] == user_id:
-                user_files.append({
-                    "file_id": file_id,
-                    **file_info
-                })
-        return user_files
+    def get_upload(self, file_id: str) -> Optional[Dict]:
+        """The upload record without its generated images"""
+        file_info = self.metadata.get(file_id)
+        if not file_info:
+            return None
+        return {"file_id": file_id, **{key: value for key, value in file_info.items() if key != "generated_files"}}
+    
+    def count_content_references(self, content_hash: str) -> int:
+        return self._content_refs.get(content_hash, 0)
+    
+    def get_generation(self, file_id: str) -> Optional[Dict]:
+        """One upload and its generated images (the generation manifest)"""
+        file_info = self.metadata.get(file_id)
+        return {"file_id": file_id, **file_info} if file_info else None
+    
+    def get_user_files(
+        self, user_id: str, limit: Optional[int] = None, after: Optional[Tuple[str, str]] = None
+    ) -> List[Dict]:
+        """The user's uploads oldest first, optionally only those after a (created_at, file_id) cursor"""
+        file_ids = self._user_files.get(user_id, [])
+        start = bisect.bisect_right(file_ids, tuple(after), key=self._sort_key) if after else 0
+        end = len(file_ids) if limit is None else start + limit
+        return [
+            {"file_id": file_id, **self.metadata[file_id]}
+            for file_id in file_ids[start:end]
+        ]
+
+    def get_user_generations(
+        self, user_id: str, limit: Optional[int] = None, before: Optional[Tuple[str, str]] = None
+    ) -> List[Dict]:
+        """Get user's generation history formatted for timeline display.
 
-    def get_user_generations(self, user_id: str) -> List[Dict]:
-        """Get user's generation history formatted for timeline display"""
+        Newest first; ``before`` is the (created_at, file_id) of the last item
+        of the previous page.
+        """
+        file_ids = self._user_files.get(user_id, [])
+        end = bisect.bisect_left(file_ids, tuple(before), key=self._sort_key) if before else len(file_ids)
         generations = []
-        for file_id, file_info in self.metadata.items():
-            if file_info["user_id"] == user_id and file_info.get("generated_files"):
-                # Get the first generated image as thumbnail
-                first_generated = file_info["generated_files"][0] if file_info["generated_files"] else None
-                thumbnail_url = f"/generated/{first_generated['filename']}" if first_generated else None
+        # The per-user index is already ordered by creation date; walk it newest first
+        for position in range(end - 1, -1, -1):
+            if limit is not None and len(generations) >= limit:
+                break
+            file_id = file_ids[position]
+            file_info = self.metadata[file_id]
+            if file_info.get("generated_files"):
+                # Use the first generated image's thumbnail, falling back to the full image
+                first_generated = file_info["generated_files"][0]
+                thumbnail_url = first_generated.get("thumbnail_url") or f"/generated/{first_generated['filename']}"
 
                 generations.append({
                     "generation_id": file_id,
@@ -72,22 +375,37 @@ class FileManager:
                     "created_at": file_info["created_at"],
                     "generated_count": len(file_info["generated_files"]),
                     "thumbnail_url": thumbnail_url,
-                    "status": "completed" if file_info["generated_files"] else "pending"
+                    "placeholder": first_generated.get("placeholder"),
+                    "status": "completed"
                 })
 
-        # Sort by creation date (newest first)
-        generations.sort(key=lambda x: x["created_at"], reverse=True)
         return generations
     
     def user_owns_file(self, file_id: str, user_id: str) -> bool:
         return self.get_file_owner(file_id) == user_id
     
+    def get_generated_file(self, filename: str) -> Optional[Dict]:
+        file_id = self._generated_owner.get(filename)
+        if file_id is None:
+            return None
+        for generated_file in self.metadata[file_id]["generated_files"]:
+            if generated_file["filename"] == filename:
+                return generated_file
+        return None
+
     def user_owns_generated_file(self, filename: str, user_id: str) -> bool:
-        for file_id, file_info in self.metadata.items():
-            if file_info["user_id"] == user_id:
-                for generated_file in file_info.get("generated_files", []):
-                    if generated_file["filename"] == filename:
-                        return True
-        return False
-
-file_manager = FileManager()
\ No newline at end of file
+        file_id = self._generated_owner.get(filename)
+        return file_id is not None and self.get_file_owner(file_id) == user_id
+
+def create_file_manager():
+    """Build the metadata store selected by METADATA_BACKEND ("sqlite" or "json")"""
+    if settings.METADATA_BACKEND == "json":
+        return FileManager(str(settings.METADATA_JSON_PATH))
+    from app.services.sqlite_file_manager import SQLiteFileManager
+    return SQLiteFileManager(
+        str(settings.METADATA_DB_PATH),
+        legacy_json_path=str(settings.METADATA_JSON_PATH),
+        busy_timeout=settings.METADATA_DB_BUSY_TIMEOUT
+    )
+
+file_manager = create_file_manager()
\ No newline at end of file
@@ -0,0 +1,69 @@
+import itertools
+import threading
+from typing import List
+
+from google import genai
+
+from app.core.config import settings
+from app.services.model_scheduler import model_scheduler
+
+
+class GeminiClientPool:
+    """Long-lived pool of Gemini clients shared by every request.
+
+    Each client keeps its own HTTP connection pool alive, and calls go through
+    the SDK's async surface (``client.aio``) so they run on the event loop
+    instead of on per-request worker threads. Every call is admitted by the
+    process-wide ``model_scheduler``, which caps in-flight calls and enforces
+    the requests-per-minute quota.
+    """
+
+    def __init__(self, size: int = None):
+        self.size = max(1, size or settings.GEMINI_CLIENT_POOL_SIZE)
+        self._clients: List[genai.Client] = []
+        self._cycle = None
+        self._lock = threading.Lock()
+
+    def _ensure_clients(self):
+        if self._clients:
+            return
+        with self._lock:
+            if self._clients:
+                return
+            if not settings.GEMINI_API_KEY:
+                raise ValueError("GEMINI_API_KEY environment variable is required")
+            self._clients = [genai.Client(api_key=settings.GEMINI_API_KEY) for _ in range(self.size)]
+            self._cycle = itertools.cycle(self._clients)
+
+    def acquire(self) -> genai.client.AsyncClient:
+        """Return the next async client in the pool"""
+        self._ensure_clients()
+        with self._lock:
+            return next(self._cycle).aio
+
+    async def generate_content(self, contents, model: str = None, config=None):
+        async def call():
+            return await self.acquire().models.generate_content(
+                model=model or settings.GEMINI_MODEL,
+                contents=contents,
+                config=config,
+            )
+
+        return await model_scheduler.run(call)
+
+    async def get_model(self, model: str = None):
+        """Fetch model metadata; a cheap call that does not spend generation quota"""
+        async def call():
+            return await self.acquire().models.get(model=model or settings.GEMINI_MODEL)
+
+        # Still scheduled, so health probes respect the rate limit and any backoff pause
+        return await model_scheduler.run(call)
+
+    def close(self):
+        """Drop the pooled clients so their connections are released"""
+        with self._lock:
+            self._clients = []
+            self._cycle = None
+
+
+gemini_pool = GeminiClientPool()
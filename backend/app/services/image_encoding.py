@@ -0,0 +1,163 @@
+import asyncio
+import base64
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image, ImageFilter
+
+from app.core.config import settings
+from app.services.image_output import FORMAT_EXTENSIONS
+from app.services.storage import write_atomic
+
+logger = logging.getLogger(__name__)
+
+_encode_pool: Optional[ProcessPoolExecutor] = None
+
+
+def parse_variant_specs(value: str) -> List[Tuple[str, int]]:
+    """Parse "WEBP:80,JPEG:85" into [("WEBP", 80), ("JPEG", 85)]"""
+    specs = []
+    for item in value.split(","):
+        if not item.strip():
+            continue
+        fmt, _, quality = item.strip().partition(":")
+        fmt = fmt.upper()
+        if fmt in FORMAT_EXTENSIONS:
+            specs.append((fmt, int(quality or 80)))
+    return specs
+
+
+def _master_format(path: Path) -> str:
+    for fmt, extension in FORMAT_EXTENSIONS.items():
+        if extension == path.suffix.lower():
+            return fmt
+    return path.suffix.lstrip(".").upper()
+
+
+def _encode(image: Image.Image, fmt: str, quality: int) -> bytes:
+    if fmt == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    options = {"quality": quality}
+    if fmt == "WEBP":
+        options["method"] = 4
+    else:
+        options["optimize"] = True
+    buffer = BytesIO()
+    image.save(buffer, format=fmt, **options)
+    return buffer.getvalue()
+
+
+def encode_outputs(master_path: str, specs: List[Tuple[str, int]], thumbnail_edge: int, placeholder_edge: int) -> Dict:
+    """Encode everything derived from a generated image; runs in a worker process.
+
+    The master is decoded once. Each requested delivery format is written
+    next to it (a format matching the master's own extension is skipped),
+    followed by a small WebP thumbnail for timelines and a tiny blurred
+    placeholder returned inline as a base64 data URI.
+    """
+    master = Path(master_path)
+    variants = [{
+        "filename": master.name,
+        "format": _master_format(master),
+        "size": master.stat().st_size,
+        "role": "master"
+    }]
+    with Image.open(master) as image:
+        image.load()
+        for fmt, quality in specs:
+            extension = FORMAT_EXTENSIONS[fmt]
+            if extension == master.suffix.lower():
+                continue
+            data = _encode(image, fmt, quality)
+            variant_path = master.with_suffix(extension)
+            write_atomic(variant_path, data)
+            variants.append({
+                "filename": variant_path.name,
+                "format": fmt,
+                "size": len(data),
+                "role": "delivery"
+            })
+
+        thumbnail = image.copy()
+        thumbnail.thumbnail((thumbnail_edge, thumbnail_edge))
+        thumbnail_path = master.with_name(f"{master.stem}_thumb.webp")
+        write_atomic(thumbnail_path, _encode(thumbnail, "WEBP", 70))
+
+        preview = thumbnail.copy()
+        preview.thumbnail((placeholder_edge, placeholder_edge))
+        preview = preview.filter(ImageFilter.GaussianBlur(1))
+        placeholder = base64.b64encode(_encode(preview, "WEBP", 30)).decode("ascii")
+
+    return {
+        "variants": variants,
+        "thumbnail": thumbnail_path.name,
+        "placeholder": f"data:image/webp;base64,{placeholder}"
+    }
+
+
+def render_derivative(source_path: str, dest_path: str, width: Optional[int], height: Optional[int], fmt: str, quality: int) -> int:
+    """Resize an image to fit within width x height and write it; runs in a worker process"""
+    with Image.open(source_path) as image:
+        image.draft("RGB", (width or image.width, height or image.height))
+        resized = image.copy()
+    resized.thumbnail((width or resized.width, height or resized.height))
+    data = _encode(resized, fmt, quality)
+    write_atomic(Path(dest_path), data)
+    return len(data)
+
+
+def _get_encode_pool() -> ProcessPoolExecutor:
+    global _encode_pool
+    if _encode_pool is None:
+        # Forking a threaded event-loop process can copy held locks into the child
+        _encode_pool = ProcessPoolExecutor(
+            max_workers=max(1, settings.ENCODE_WORKERS), mp_context=multiprocessing.get_context("spawn")
+        )
+    return _encode_pool
+
+
+async def run_in_encode_pool(func, *args):
+    """Run a CPU-bound, picklable function in the shared encoding process pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_encode_pool(), func, *args)
+
+
+async def encode_generated_outputs(filename: str) -> Dict:
+    """Produce delivery variants, thumbnail and placeholder for a generated image off the event loop"""
+    master_path = settings.GENERATED_DIR / filename
+    specs = parse_variant_specs(settings.GENERATED_VARIANT_FORMATS)
+    try:
+        return await run_in_encode_pool(
+            encode_outputs, str(master_path), specs,
+            settings.THUMBNAIL_MAX_EDGE, settings.PLACEHOLDER_MAX_EDGE
+        )
+    except Exception as e:
+        logger.error(f"Encoding outputs for {filename} failed: {e}")
+        return {
+            "variants": [{
+                "filename": filename,
+                "format": _master_format(master_path),
+                "size": os.path.getsize(master_path),
+                "role": "master"
+            }],
+            "thumbnail": None,
+            "placeholder": None
+        }
+
+
+def pick_smallest_variant(variants: Optional[List[Dict]]) -> Optional[Dict]:
+    if not variants:
+        return None
+    return min(variants, key=lambda variant: variant.get("size") or float("inf"))
+
+
+def shutdown_encode_pool():
+    global _encode_pool
+    if _encode_pool is not None:
+        _encode_pool.shutdown(wait=False, cancel_futures=True)
+        _encode_pool = None
@@ -1,25 +1,24 @@
-import os
-from google import genai
-from google.genai import types
-from PIL import Image
-from io import BytesIO
-from pathlib import Path
-import uuid
-from typing import List
+from typing import AsyncIterator, List, Optional
 import asyncio
-import concurrent.futures
 import time
+import uuid
 
 from app.core.config import settings
+from app.services.gemini_pool import gemini_pool
+from app.services.model_health import ModelUnavailableError, model_health, is_backend_failure
+from app.services.fair_scheduler import fair_scheduler
+from app.services.image_input import PreparedImage, file_sha256, prepare_image
+from app.services.prompt_cache import prompt_cache
+from app.services.image_output import write_generated_image
+from app.services.image_encoding import encode_generated_outputs, pick_smallest_variant
 
-GENERATED_DIR = settings.GENERATED_DIR
+MARKETING_CONTEXTS = [
+    "lifestyle", "product showcase", "social media", "e-commerce", "advertising",
+    "catalog", "artistic", "minimalist", "luxury", "casual"
+]
 
-async def analyze_image_and_generate_prompts(client, image_path: str, num_prompts: int) -> List[str]:
-    """Analyze the uploaded image and generate dynamic prompts based on its content"""
-    try:
-        image = Image.open(image_path)
-        
-        analysis_prompt = f"""Analyze this image carefully and identify:
+def _analysis_prompt(num_prompts: int, chunk_index: int = None) -> str:
+    prompt = f"""Analyze this image carefully and identify:
 1. What type of product this is
 2. The style/aesthetic of the product
 3. Key visual characteristics
@@ -33,22 +32,96 @@ Based on your analysis, create {num_prompts} different image generation prompts
 - Be diverse and offer different creative approaches
 
 Return only the {num_prompts} prompts, one per line, without any additional text or numbering."""
+    if chunk_index is not None:
+        # Steer each batch towards different contexts so parallel batches don't overlap
+        focus = ", ".join(MARKETING_CONTEXTS[(chunk_index * 3 + i) % len(MARKETING_CONTEXTS)] for i in range(3))
+        prompt += f"\n\nConcentrate mainly on these marketing contexts: {focus}."
+    return prompt
+
+def _prompt_style(prompt: str) -> Optional[str]:
+    """The marketing context a prompt targets, taken from the first one it names"""
+    text = prompt.lower()
+    matches = [(text.find(context), context) for context in MARKETING_CONTEXTS if context in text]
+    return min(matches)[1].title() if matches else None
+
+def _prompt_key(prompt: str) -> str:
+    return " ".join(prompt.lower().split())
+
+def _distinct_prompts(prompts: List[str]) -> List[str]:
+    seen = set()
+    distinct = []
+    for prompt in prompts:
+        key = _prompt_key(prompt)
+        if key not in seen:
+            seen.add(key)
+            distinct.append(prompt)
+    return distinct
+
+async def _request_prompts(image: PreparedImage, num_prompts: int, chunk_index: int = None) -> List[str]:
+    response = await _generate_content([_analysis_prompt(num_prompts, chunk_index), image.as_part()])
+    if not response.text:
+        return []
+    return [prompt.strip() for prompt in response.text.strip().split('\n') if prompt.strip()][:num_prompts]
 
-        response = client.models.generate_content(
-            model="gemini-2.5-flash-image-preview",
-            contents=[analysis_prompt, image]
+async def _request_prompts_chunked(image: PreparedImage, num_prompts: int) -> List[str]:
+    """Split a large prompt request into parallel batches and merge the distinct results"""
+    chunk_size = max(1, settings.ANALYSIS_CHUNK_SIZE)
+    semaphore = asyncio.Semaphore(max(1, settings.ANALYSIS_MAX_PARALLEL))
+
+    async def request_chunk(chunk_index: int, size: int) -> List[str]:
+        async with semaphore:
+            return await _request_prompts(image, size, chunk_index)
+
+    prompts: List[str] = []
+    seen = set()
+    chunks_sent = 0
+    # One top-up round asks again for whatever the first round failed to deliver
+    for _ in range(2):
+        missing = num_prompts - len(prompts)
+        if missing <= 0:
+            break
+        sizes = [min(chunk_size, missing - i * chunk_size) for i in range(-(-missing // chunk_size))]
+        results = await asyncio.gather(
+            *(request_chunk(chunks_sent + index, size) for index, size in enumerate(sizes)),
+            return_exceptions=True
         )
+        chunks_sent += len(sizes)
+        for result in results:
+            if isinstance(result, BaseException):
+                print(f"Error analyzing image for prompts: {result}")
+                continue
+            for prompt in result:
+                key = _prompt_key(prompt)
+                if key not in seen:
+                    seen.add(key)
+                    prompts.append(prompt)
+    return prompts[:num_prompts]
+
+async def analyze_image_and_generate_prompts(image: PreparedImage, num_prompts: int, content_hash: str = None) -> List[str]:
+    """Analyze the uploaded image and generate dynamic prompts based on its content"""
+    # Re-generation of the same upload (or the same photo from another user) skips the model call
+    if content_hash:
+        cached_prompts = await asyncio.to_thread(prompt_cache.get, content_hash, num_prompts)
+        if cached_prompts:
+            print(f"Using {len(cached_prompts)} cached prompts for {content_hash[:12]}")
+            return cached_prompts
+    
+    try:
+        if num_prompts > settings.ANALYSIS_CHUNK_SIZE:
+            prompts = await _request_prompts_chunked(image, num_prompts)
+        else:
+            prompts = await _request_prompts(image, num_prompts)
         
-        if response.text:
-            prompts = [prompt.strip() for prompt in response.text.strip().split('\n') if prompt.strip()]
-            # Ensure we have exactly the requested number of prompts
-            if len(prompts) >= num_prompts:
-                return prompts[:num_prompts]
-            elif len(prompts) > 0:
-                # If we got fewer prompts, pad with variations
-                while len(prompts) < num_prompts:
-                    prompts.append(prompts[len(prompts) % len(prompts)])  # Cycle through existing prompts
-                return prompts[:num_prompts]
+        if prompts:
+            # Only the distinct prompts are cached, so a short answer is never replayed as duplicates
+            prompts = _distinct_prompts(prompts)
+            if content_hash:
+                await asyncio.to_thread(prompt_cache.put, content_hash, prompts)
+            # If we got fewer prompts, pad this request's copy with variations
+            padded = list(prompts)
+            while len(padded) < num_prompts:
+                padded.append(prompts[len(padded) % len(prompts)])  # Cycle through existing prompts
+            return padded
         
     except Exception as e:
         print(f"Error analyzing image for prompts: {e}")
@@ -73,9 +146,28 @@ Return only the {num_prompts} prompts, one per line, without any additional text
     
     return generic_prompts[:num_prompts]
 
-async def generate_images(image_path: str, file_id: str, num_images: int = None) -> List[dict]:
-    key = os.getenv("GEMINI_API_KEY")
-    if not key:
+async def _generate_content(contents):
+    """Call the model and report the outcome to the circuit breaker"""
+    try:
+        response = await gemini_pool.generate_content(contents)
+    except Exception as e:
+        if is_backend_failure(e):
+            model_health.record_failure(e)
+        raise
+    model_health.record_success()
+    return response
+
+async def iter_generated_images(
+    image_path: str, file_id: str, num_images: int = None, user_id: str = None, content_hash: str = None
+) -> AsyncIterator[dict]:
+    """Yield each generated image's info as soon as it has been saved.
+
+    ``content_hash`` is the upload's SHA-256 as recorded at upload time; it is
+    only recomputed from the file for uploads stored before it was recorded.
+    Raises ModelUnavailableError, before any model call, while the circuit
+    breaker is turning requests away.
+    """
+    if not settings.GEMINI_API_KEY:
         raise ValueError("GEMINI_API_KEY environment variable is required")
     
     # Use provided number of images or fall back to configured default
@@ -83,90 +175,94 @@ async def generate_images(image_path: str, file_id: str, num_images: int = None)
         num_images = settings.NUM_IMAGES
     print(f"Generating {num_images} images...")
     
-    try:
-        client = genai.Client(api_key=key)
-        
-        # First test basic API connectivity
-        test_response = client.models.generate_content(
-            model="gemini-2.5-flash-image-preview",
-            contents="Say hello"
-        )
-        print(f"API test successful: {test_response.text}")
-        
-    except Exception as e:
-        print(f"API connection failed: {e}")
-        # Return mock data for now
-        mock_files = []
-        for i in range(num_images):
-            mock_files.append({
-                "filename": f"{file_id}_mock_{i+1}.png",
-                "url": f"/generated/{file_id}_mock_{i+1}.png",
-                "style": f"style_{i+1}",
-                "description": f"Mock image {i+1} - API unavailable"
-            })
-        return mock_files
+    # Fail fast from the cached health state; no probe on the hot path
+    if not model_health.allow_request():
+        print(f"Model backend unavailable ({model_health.last_error}); rejecting generation")
+        raise ModelUnavailableError("Image model is temporarily unavailable")
+    
+    # Decode and encode the source once; every model call below reuses the payload
+    image = await asyncio.to_thread(prepare_image, image_path)
+    image_part = image.as_part()
+    if not content_hash:
+        content_hash = await asyncio.to_thread(file_sha256, image_path)
     
     # Generate dynamic prompts based on image analysis
-    prompts = await analyze_image_and_generate_prompts(client, image_path, num_images)
+    prompts = await analyze_image_and_generate_prompts(image, num_images, content_hash)
     print("=== Generated Dynamic Prompts ===")
     for i, prompt in enumerate(prompts, 1):
         print(f"Prompt {i}: {prompt}")
     print("===============================")
     
-    def generate_single_image_sync(prompt: str, index: int):
-        """Synchronous function to generate a single image"""
+    weight = await fair_scheduler.weight_for(user_id)
+    run_id = uuid.uuid4().hex[:8]
+
+    async def generate_single_image(prompt: str, index: int):
+        """Generate a single image through the shared client pool"""
         try:
-            # Create a separate client for each thread to avoid conflicts
-            thread_client = genai.Client(api_key=key)
-            image = Image.open(image_path)
-            
             print(f"Starting generation for image {index+1}...")
             start_time = time.time()
             
-            response = thread_client.models.generate_content(
-                model="gemini-2.5-flash-image-preview",
-                contents=[prompt, image],
-            )
+            # Queue behind other users' work according to plan weight
+            async with fair_scheduler.slot(user_id, weight):
+                response = await _generate_content([prompt, image_part])
             
             for part in response.candidates[0].content.parts:
                 if part.text is not None:
                     print(f"Generated text response: {part.text}")
                 elif part.inline_data is not None:
-                    generated_image = Image.open(BytesIO(part.inline_data.data))
-                    
-                    filename = f"{file_id}_generated_{index+1}.png"
-                    output_path = GENERATED_DIR / filename
-                    generated_image.save(output_path)
+                    filename = await asyncio.to_thread(
+                        write_generated_image, part.inline_data.data, part.inline_data.mime_type, file_id, run_id, index
+                    )
+                    # CPU-bound encoding runs in the process pool, away from the loop and the GIL
+                    outputs = await encode_generated_outputs(filename)
+                    delivery = pick_smallest_variant(outputs["variants"])
+                    thumbnail = outputs["thumbnail"]
                     
                     elapsed = time.time() - start_time
                     print(f"Generated image {index+1}: {filename} (took {elapsed:.2f}s)")
-                    return {
+                    image_info = {
                         "filename": filename,
-                        "url": f"/generated/{filename}",
-                        "style": f"style_{index+1}",
-                        "description": prompt
+                        "url": f"/generated/{delivery['filename']}",
+                        "description": prompt,
+                        "variants": outputs["variants"],
+                        "thumbnail_url": f"/generated/{thumbnail}" if thumbnail else None,
+                        "placeholder": outputs["placeholder"]
                     }
+                    # Only a style the prompt actually names; never a positional placeholder
+                    style = _prompt_style(prompt)
+                    if style:
+                        image_info["style"] = style
+                    return image_info
         
         except Exception as e:
             print(f"Error generating image {index+1}: {str(e)}")
             return None
     
-    # Use ThreadPoolExecutor for true parallel execution
+    # Run all generations concurrently on the event loop; the pool caps in-flight calls
     print(f"Starting parallel generation of {len(prompts)} images...")
     start_time = time.time()
     
-    with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(prompts), 10)) as executor:
-        # Submit all tasks
-        future_to_index = {executor.submit(generate_single_image_sync, prompt, i): i 
-                          for i, prompt in enumerate(prompts)}
-        
-        generated_files = []
-        for future in concurrent.futures.as_completed(future_to_index):
-            result = future.result()
+    tasks = [asyncio.create_task(generate_single_image(prompt, i)) for i, prompt in enumerate(prompts)]
+    
+    generated_count = 0
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            result = await next_done
             if result:
-                generated_files.append(result)
+                generated_count += 1
+                yield result
+    finally:
+        # Stop outstanding calls if the consumer goes away early
+        for task in tasks:
+            task.cancel()
     
     total_time = time.time() - start_time
-    print(f"All {len(generated_files)} images generated in {total_time:.2f}s (parallel execution)")
-    
-    return generated_files
+    print(f"All {generated_count} images generated in {total_time:.2f}s (parallel execution)")
+
+async def generate_images(
+    image_path: str, file_id: str, num_images: int = None, user_id: str = None, content_hash: str = None
+) -> List[dict]:
+    return [
+        image_info
+        async for image_info in iter_generated_images(image_path, file_id, num_images, user_id, content_hash)
+    ]
@@ -0,0 +1,167 @@
+import hashlib
+from dataclasses import dataclass
+from io import BytesIO
+from pathlib import Path
+from typing import Optional, Tuple
+
+from google.genai import types
+from PIL import Image, ImageOps
+
+from app.core.config import settings
+from app.services.storage import write_atomic
+
+_FORMAT_MIME_TYPES = {
+    "WEBP": ("image/webp", ".webp"),
+    "JPEG": ("image/jpeg", ".jpg"),
+}
+
+# What an upload's extension promises, and the content types browsers send for it
+UPLOAD_FORMATS = {
+    ".jpg": "JPEG",
+    ".jpeg": "JPEG",
+    ".png": "PNG",
+    ".webp": "WEBP",
+}
+_UPLOAD_CONTENT_TYPES = {
+    "JPEG": {"image/jpeg", "image/jpg", "image/pjpeg"},
+    "PNG": {"image/png"},
+    "WEBP": {"image/webp"},
+}
+
+
+class InvalidImageError(ValueError):
+    """An upload that is not the image it claims to be, or is too large to process"""
+    pass
+
+
+@dataclass(frozen=True)
+class PreparedImage:
+    """A source image decoded once and re-encoded into a compact payload"""
+    data: bytes
+    mime_type: str
+    width: int
+    height: int
+
+    def as_part(self) -> types.Part:
+        return types.Part.from_bytes(data=self.data, mime_type=self.mime_type)
+
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _is_truncated(path: Path, fmt: str) -> bool:
+    """Cheap end-of-file check for the container formats that have one.
+
+    PNG must end with its IEND chunk and a WebP RIFF header records the file
+    size. JPEG is not checked: EOI is often followed by appended data (motion
+    photos, maker trailers) that decoders accept.
+    """
+    with open(path, "rb") as f:
+        if fmt == "PNG":
+            f.seek(0, 2)
+            f.seek(max(0, f.tell() - 12))
+            return b"IEND" not in f.read()
+        if fmt == "WEBP":
+            header = f.read(8)
+            f.seek(0, 2)
+            return len(header) < 8 or int.from_bytes(header[4:8], "little") + 8 > f.tell()
+    return False
+
+
+def validate_image_header(path: Path, extension: str, content_type: Optional[str] = None) -> Tuple[str, int, int]:
+    """Check an upload's real format and dimensions from its header; return (format, width, height).
+
+    Only the parser for the format the extension promises is tried, and
+    Image.open stops after the header, so no pixel data is decoded. Rejects
+    content that does not match the extension or content type, truncated
+    PNG/WebP files, and images over MAX_IMAGE_PIXELS (decompression bombs)
+    before anything decodes them.
+    """
+    expected = UPLOAD_FORMATS.get(extension.lower())
+    if expected is None:
+        raise InvalidImageError("File type not allowed")
+    try:
+        with Image.open(path, formats=[expected]) as image:
+            width, height = image.size
+    except Image.DecompressionBombError:
+        raise InvalidImageError("Image dimensions are too large")
+    except (Image.UnidentifiedImageError, OSError, SyntaxError):
+        raise InvalidImageError(f"File is not a valid {expected} image")
+
+    if width < 1 or height < 1 or width * height > settings.MAX_IMAGE_PIXELS:
+        raise InvalidImageError("Image dimensions are too large")
+    if _is_truncated(path, expected):
+        raise InvalidImageError(f"File is not a valid {expected} image")
+    if content_type and content_type.lower() not in _UPLOAD_CONTENT_TYPES[expected]:
+        raise InvalidImageError("Content type does not match the image format")
+    return expected, width, height
+
+
+def _input_format() -> str:
+    fmt = settings.MODEL_INPUT_FORMAT.upper()
+    return fmt if fmt in _FORMAT_MIME_TYPES else "JPEG"
+
+
+def normalized_path(image_path: str) -> Path:
+    """Where the normalized copy of an upload is cached, next to the upload itself"""
+    source = Path(image_path)
+    _, extension = _FORMAT_MIME_TYPES[_input_format()]
+    return source.with_name(f"{source.stem}.model-{settings.MODEL_INPUT_MAX_EDGE}{extension}")
+
+
+def _normalize(image_path: str) -> Image.Image:
+    with Image.open(image_path) as source:
+        # Bake the EXIF orientation into the pixels; the EXIF block itself is not re-written
+        image = ImageOps.exif_transpose(source)
+        image.thumbnail((settings.MODEL_INPUT_MAX_EDGE, settings.MODEL_INPUT_MAX_EDGE))
+    for key in ("exif", "xmp", "XML:com.adobe.xmp"):
+        image.info.pop(key, None)
+
+    has_alpha = "A" in image.getbands() or "transparency" in image.info
+    if _input_format() == "JPEG" and has_alpha:
+        # JPEG has no alpha channel; flatten transparent product shots onto white
+        rgba = image.convert("RGBA")
+        image = Image.new("RGB", rgba.size, (255, 255, 255))
+        image.paste(rgba, mask=rgba.getchannel("A"))
+    elif image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if has_alpha else "RGB")
+    return image
+
+
+def prepare_image(image_path: str) -> PreparedImage:
+    """Return the model-ready version of an upload, normalizing it on first use.
+
+    The upload is resized to MODEL_INPUT_MAX_EDGE, stripped of EXIF and encoded
+    as MODEL_INPUT_FORMAT. The result is cached next to the upload in
+    UPLOAD_DIR, so later requests for the same file skip the decode entirely,
+    and within a request it is shared by the analysis call and every
+    generation call.
+    """
+    fmt = _input_format()
+    mime_type, _ = _FORMAT_MIME_TYPES[fmt]
+    cache_path = normalized_path(image_path)
+
+    try:
+        if cache_path.stat().st_mtime >= Path(image_path).stat().st_mtime:
+            data = cache_path.read_bytes()
+            # Opening only parses the header; the pixels are never decoded here
+            with Image.open(BytesIO(data)) as cached:
+                return PreparedImage(data=data, mime_type=mime_type, width=cached.width, height=cached.height)
+    except (OSError, Image.UnidentifiedImageError):
+        pass
+
+    image = _normalize(image_path)
+    buffer = BytesIO()
+    image.save(buffer, format=fmt, quality=settings.MODEL_INPUT_QUALITY)
+    data = buffer.getvalue()
+    try:
+        write_atomic(cache_path, data)
+    except OSError:
+        pass
+
+    return PreparedImage(data=data, mime_type=mime_type, width=image.width, height=image.height)
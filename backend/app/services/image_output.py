@@ -0,0 +1,68 @@
+import re
+from io import BytesIO
+from typing import Optional
+
+from PIL import Image
+
+from app.core.config import settings
+from app.services.storage import write_atomic
+
+MIME_EXTENSIONS = {
+    "image/png": ".png",
+    "image/jpeg": ".jpg",
+    "image/webp": ".webp",
+}
+
+FORMAT_EXTENSIONS = {
+    "PNG": ".png",
+    "JPEG": ".jpg",
+    "WEBP": ".webp",
+}
+
+# {file_id}_generated_{run_id}_{n}, plus the _thumb suffix of its thumbnail
+_RUN_SCOPED_NAME = re.compile(r"_generated_[0-9a-f]{8}_\d+(_thumb)?\.[a-z]+$")
+
+
+def _transcode(data: bytes, fmt: str) -> bytes:
+    with Image.open(BytesIO(data)) as image:
+        if fmt == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        buffer = BytesIO()
+        image.save(buffer, format=fmt, quality=settings.GENERATED_TRANSCODE_QUALITY)
+        return buffer.getvalue()
+
+
+def is_run_scoped(filename: str) -> bool:
+    """Whether a file in GENERATED_DIR belongs to one generation run and so is never rewritten.
+
+    Covers masters named by ``write_generated_image`` and the variants and
+    thumbnails derived from them; older ``{file_id}_generated_{n}`` files
+    could be overwritten by a later run.
+    """
+    return _RUN_SCOPED_NAME.search(filename) is not None
+
+
+def write_generated_image(data: bytes, mime_type: Optional[str], file_id: str, run_id: str, index: int) -> str:
+    """Persist a model output to GENERATED_DIR and return its filename.
+
+    ``run_id`` is unique per generation run, so generating from the same
+    upload again never overwrites a file that clients may have cached.
+
+    The model already returns an encoded image, so by default the bytes are
+    written as-is under the extension matching their mime type. Pixels are
+    only decoded when GENERATED_TRANSCODE_FORMAT asks for a different format
+    or the mime type is not one we can serve directly.
+    """
+    transcode_format = settings.GENERATED_TRANSCODE_FORMAT.upper()
+    extension = MIME_EXTENSIONS.get((mime_type or "").lower())
+
+    if transcode_format in FORMAT_EXTENSIONS and FORMAT_EXTENSIONS[transcode_format] != extension:
+        data = _transcode(data, transcode_format)
+        extension = FORMAT_EXTENSIONS[transcode_format]
+    elif extension is None:
+        data = _transcode(data, "PNG")
+        extension = ".png"
+
+    filename = f"{file_id}_generated_{run_id}_{index+1}{extension}"
+    write_atomic(settings.GENERATED_DIR / filename, data)
+    return filename
@@ -0,0 +1,259 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+from app.core.config import settings
+from app.services.credits import credit_manager
+from app.services.file_manager import file_manager
+from app.services.image_generator import iter_generated_images
+
+logger = logging.getLogger(__name__)
+
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+
+class JobStore:
+    """Durable SQLite store for generation jobs"""
+
+    def __init__(self, db_path: Path = None):
+        self.db_path = Path(db_path or settings.JOBS_DB_PATH)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                file_id TEXT NOT NULL,
+                image_path TEXT NOT NULL,
+                num_images INTEGER NOT NULL,
+                cost INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                images TEXT NOT NULL DEFAULT '[]',
+                refunded INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                worker TEXT,
+                lease_until REAL,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_user_id ON jobs(user_id)")
+        self._conn.commit()
+
+    def _row_to_job(self, row: sqlite3.Row) -> Dict:
+        job = dict(row)
+        job["images"] = json.loads(job["images"])
+        return job
+
+    def create(self, user_id: str, file_id: str, image_path: str, num_images: int, cost: int) -> Dict:
+        now = datetime.utcnow().isoformat()
+        job_id = str(uuid.uuid4())
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (job_id, user_id, file_id, image_path, num_images, cost, status, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, user_id, file_id, image_path, num_images, cost, QUEUED, now, now),
+            )
+            self._conn.commit()
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def update(self, job_id: str, owner: str = None, **fields) -> bool:
+        """Update a job; with ``owner`` only while that worker still holds it. Returns whether a row changed"""
+        if "images" in fields:
+            fields["images"] = json.dumps(fields["images"])
+        fields["updated_at"] = datetime.utcnow().isoformat()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        query = f"UPDATE jobs SET {assignments} WHERE job_id = ?"
+        params = [*fields.values(), job_id]
+        if owner is not None:
+            query += " AND worker = ?"
+            params.append(owner)
+        with self._lock:
+            changed = self._conn.execute(query, params).rowcount
+            self._conn.commit()
+        return changed > 0
+
+    def claim(self, job_id: str, worker: str, lease_until: float) -> bool:
+        """Atomically take a queued job, or a running one whose worker let its lease expire"""
+        with self._lock:
+            changed = self._conn.execute(
+                "UPDATE jobs SET status = ?, worker = ?, lease_until = ?, updated_at = ? "
+                "WHERE job_id = ? AND (status = ? OR (status = ? AND lease_until < ?))",
+                (RUNNING, worker, lease_until, datetime.utcnow().isoformat(), job_id, QUEUED, RUNNING, time.time()),
+            ).rowcount
+            self._conn.commit()
+        return changed > 0
+
+    def claimable_job_ids(self) -> List[str]:
+        """Queued jobs and running jobs whose lease has expired, oldest first"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT job_id FROM jobs WHERE status = ? OR (status = ? AND lease_until < ?) ORDER BY created_at",
+                (QUEUED, RUNNING, time.time()),
+            ).fetchall()
+        return [row["job_id"] for row in rows]
+
+    def release(self, worker: str):
+        """Expire the leases a stopping worker holds so another worker can resume its jobs right away"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET lease_until = 0 WHERE worker = ? AND status = ?", (worker, RUNNING)
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class JobManager:
+    """In-process async worker pool that runs generation jobs from the JobStore.
+
+    Jobs are persisted before they are queued, so they run to completion even
+    if the client that submitted them disconnects. Several processes can share
+    one store: a job is claimed atomically before it runs and the claim is a
+    lease the running worker keeps renewing, so each job runs in exactly one
+    place, and a job whose worker died is taken over once its lease expires.
+    The store is opened by ``start`` unless one is passed in.
+    """
+
+    def __init__(self, store: JobStore = None, num_workers: int = None, lease_seconds: float = None):
+        self.store = store
+        self.num_workers = max(1, num_workers or settings.JOB_WORKERS)
+        self.lease_seconds = lease_seconds or settings.JOB_LEASE_SECONDS
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._queue: Optional[asyncio.Queue] = None
+        self._queued: Set[str] = set()
+        self._workers: List[asyncio.Task] = []
+
+    def start(self):
+        if self._workers:
+            return
+        if self.store is None:
+            self.store = JobStore()
+        self._queue = asyncio.Queue()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.num_workers)]
+        # Picks up jobs left by a restart or by a worker process that died
+        self._workers.append(asyncio.create_task(self._recover_loop()))
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queued.clear()
+        if self.store is not None:
+            self.store.release(self.worker_id)
+            self.store.close()
+            self.store = None
+
+    def _enqueue(self, job_id: str):
+        if job_id not in self._queued:
+            self._queued.add(job_id)
+            self._queue.put_nowait(job_id)
+
+    def submit(self, user_id: str, file_id: str, image_path: str, num_images: int, cost: int) -> Dict:
+        job = self.store.create(user_id, file_id, image_path, num_images, cost)
+        if self._queue is not None:
+            self._enqueue(job["job_id"])
+        return job
+
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        return self.store.get(job_id)
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            self._queued.discard(job_id)
+            try:
+                await self._run_job(job_id)
+            except Exception as e:
+                logger.error(f"Job {job_id} crashed: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _recover_loop(self):
+        while True:
+            try:
+                for job_id in self.store.claimable_job_ids():
+                    self._enqueue(job_id)
+            except Exception as e:
+                logger.error(f"Scanning for unclaimed jobs failed: {e}")
+            await asyncio.sleep(self.lease_seconds / 2)
+
+    async def _renew_lease(self, job_id: str):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            if not self.store.update(job_id, owner=self.worker_id, lease_until=time.time() + self.lease_seconds):
+                return
+
+    def _finish(self, job: Dict, delivered: int, status: str, error: str = None):
+        """Record the outcome and refund the images that were charged for but not delivered.
+
+        The row is updated first and only while this worker still holds the
+        job, so a worker that lost its lease can never refund a second time.
+        """
+        refund = max(0, (job["num_images"] - delivered) * (job["cost"] // job["num_images"]))
+        if not self.store.update(job["job_id"], owner=self.worker_id, status=status, refunded=refund, error=error):
+            return
+        if refund:
+            try:
+                credit_manager.add_credits(job["user_id"], refund)
+            except Exception:
+                self.store.update(job["job_id"], refunded=0)
+
+    async def _run_job(self, job_id: str):
+        if not self.store.claim(job_id, self.worker_id, time.time() + self.lease_seconds):
+            # Finished, or running under another worker's live lease
+            return
+        job = self.store.get(job_id)
+
+        # A resumed job keeps the images it already produced and only generates the rest
+        images = job["images"]
+        remaining = job["num_images"] - len(images)
+
+        lease = asyncio.create_task(self._renew_lease(job_id))
+        try:
+            upload = file_manager.get_upload(job["file_id"]) or {}
+            if remaining > 0:
+                async for image_info in iter_generated_images(
+                    job["image_path"], job["file_id"], remaining, job["user_id"], upload.get("content_hash")
+                ):
+                    # Register before the job row exposes it to GET /jobs/{id}
+                    await asyncio.to_thread(file_manager.add_generated_files, job["file_id"], [image_info])
+                    images.append(image_info)
+                    if not self.store.update(job_id, owner=self.worker_id, images=images):
+                        logger.warning(f"Job {job_id} was taken over by another worker; stopping")
+                        return
+        except Exception as e:
+            self._finish(job, len(images), FAILED, f"Generation failed: {str(e)}")
+            return
+        finally:
+            lease.cancel()
+
+        # Failed model calls are skipped rather than raised, so a finished job can still come up short
+        self._finish(job, len(images), COMPLETED)
+
+
+job_manager = JobManager()
@@ -0,0 +1,127 @@
+import asyncio
+import logging
+import threading
+import time
+from typing import Optional
+
+from app.core.config import settings
+from app.services.gemini_pool import gemini_pool
+from app.services.model_scheduler import SchedulerTimeout
+
+logger = logging.getLogger(__name__)
+
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class ModelUnavailableError(Exception):
+    """Raised instead of calling the model while the circuit breaker turns requests away"""
+
+
+def is_backend_failure(exc: BaseException) -> bool:
+    """Whether an error says the model backend is unhealthy (vs. a bad request)"""
+    if isinstance(exc, SchedulerTimeout):
+        # Our own queue was saturated; the backend itself may be fine
+        return False
+    code = getattr(exc, "code", None)
+    if isinstance(code, int):
+        return code >= 500
+    # No status code means the call never got a response (timeout, connection error)
+    return True
+
+
+class ModelHealth:
+    """Cached health state of the image model with a circuit breaker.
+
+    Real generation calls report their outcome through ``record_success`` and
+    ``record_failure``; after ``failure_threshold`` consecutive failures the
+    circuit opens and ``allow_request`` returns False until ``reset_timeout``
+    has passed. Then a single trial request is let through (half-open) and the
+    rest are turned away until its outcome closes or reopens the circuit.
+    A background prober keeps the state fresh using a metadata call, so the
+    request path never has to make an extra network round trip.
+    """
+
+    def __init__(self, failure_threshold: int = None, reset_timeout: float = None, probe_interval: float = None):
+        self.failure_threshold = max(1, failure_threshold or settings.MODEL_HEALTH_FAILURE_THRESHOLD)
+        self.reset_timeout = reset_timeout if reset_timeout is not None else settings.MODEL_HEALTH_RESET_TIMEOUT
+        self.probe_interval = probe_interval if probe_interval is not None else settings.MODEL_HEALTH_PROBE_INTERVAL
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+        # When the half-open trial was admitted; None while no trial is in flight
+        self._trial_started: Optional[float] = None
+        self._lock = threading.Lock()
+        self._probe_task: Optional[asyncio.Task] = None
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            now = time.monotonic()
+            if self.state == OPEN:
+                if now - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = HALF_OPEN
+            elif self._trial_started is not None and now - self._trial_started < self.reset_timeout:
+                # Only one trial at a time; a trial that never reported back expires
+                return False
+            self._trial_started = now
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                logger.info("Model backend recovered; closing circuit")
+            self.state = CLOSED
+            self.consecutive_failures = 0
+            self.opened_at = None
+            self._trial_started = None
+            self.last_error = None
+
+    def record_failure(self, exc: BaseException = None):
+        with self._lock:
+            self.consecutive_failures += 1
+            self.last_error = str(exc) if exc else None
+            if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    logger.warning(f"Model backend unhealthy; opening circuit: {self.last_error}")
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self._trial_started = None
+
+    async def probe(self) -> bool:
+        try:
+            await gemini_pool.get_model()
+        except Exception as e:
+            if is_backend_failure(e):
+                self.record_failure(e)
+            return False
+        self.record_success()
+        return True
+
+    async def _probe_loop(self):
+        while True:
+            await self.probe()
+            await asyncio.sleep(self.probe_interval)
+
+    def start(self):
+        if not settings.GEMINI_API_KEY or self.probe_interval <= 0:
+            return
+        if self._probe_task is None or self._probe_task.done():
+            self._probe_task = asyncio.create_task(self._probe_loop())
+
+    async def stop(self):
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            try:
+                await self._probe_task
+            except asyncio.CancelledError:
+                pass
+            self._probe_task = None
+
+
+model_health = ModelHealth()
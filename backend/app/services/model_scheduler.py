@@ -0,0 +1,127 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+RETRYABLE_STATUS_CODES = {429, 503}
+
+
+class SchedulerTimeout(Exception):
+    """A queued model call could not start within the allowed wait"""
+
+
+def is_retryable(exc: BaseException) -> bool:
+    return getattr(exc, "code", None) in RETRYABLE_STATUS_CODES
+
+
+class ModelCallScheduler:
+    """Process-wide admission control for outbound model calls.
+
+    Every call takes a token from a requests-per-minute bucket and then a
+    concurrency slot before it is sent. Slots are only held while a call is
+    in flight, never while waiting for a token or backing off. When the
+    backend answers 429/503 the whole scheduler pauses for an exponentially
+    growing, jittered delay so that queued calls back off together instead
+    of piling into a retry storm.
+    Calls that cannot start within ``max_queue_wait`` seconds fail with
+    ``SchedulerTimeout`` rather than waiting forever.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: int = None,
+        max_concurrency: int = None,
+        burst: int = None,
+        max_queue_wait: float = None,
+        max_retries: int = None,
+        backoff_base: float = None,
+        backoff_max: float = None,
+    ):
+        self.requests_per_minute = max(1, requests_per_minute or settings.MODEL_REQUESTS_PER_MINUTE)
+        self.max_concurrency = max(1, max_concurrency or settings.GEMINI_MAX_CONCURRENCY)
+        self.burst = max(1, burst or settings.MODEL_RATE_LIMIT_BURST or self.max_concurrency)
+        self.max_queue_wait = max_queue_wait if max_queue_wait is not None else settings.MODEL_MAX_QUEUE_WAIT
+        self.max_retries = max_retries if max_retries is not None else settings.MODEL_MAX_RETRIES
+        self.backoff_base = backoff_base if backoff_base is not None else settings.MODEL_BACKOFF_BASE
+        self.backoff_max = backoff_max if backoff_max is not None else settings.MODEL_BACKOFF_MAX
+
+        self._tokens = float(self.burst)
+        self._last_refill = time.monotonic()
+        self._paused_until = 0.0
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def _refill_rate(self) -> float:
+        return self.requests_per_minute / 60.0
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # Semaphores are bound to the loop they are first used on
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._loop = loop
+        return self._semaphore
+
+    def _refill(self, now: float):
+        elapsed = now - self._last_refill
+        self._tokens = min(float(self.burst), self._tokens + elapsed * self._refill_rate)
+        self._last_refill = now
+
+    async def _wait_for_token(self, deadline: float):
+        while True:
+            now = time.monotonic()
+            if self._paused_until > now:
+                wait = self._paused_until - now
+            else:
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self._refill_rate
+            if now + wait > deadline:
+                raise SchedulerTimeout(f"Model call could not be scheduled within {self.max_queue_wait:g}s")
+            await asyncio.sleep(wait)
+
+    async def _acquire_slot(self, semaphore: asyncio.Semaphore, deadline: float):
+        if not semaphore.locked():
+            await semaphore.acquire()
+            return
+        try:
+            await asyncio.wait_for(semaphore.acquire(), timeout=deadline - time.monotonic())
+        except asyncio.TimeoutError:
+            raise SchedulerTimeout(f"Model call could not be scheduled within {self.max_queue_wait:g}s")
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter keeps retries from different requests from lining up
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    async def run(self, call: Callable[[], Awaitable[T]]) -> T:
+        semaphore = self._get_semaphore()
+        attempt = 0
+        while True:
+            deadline = time.monotonic() + self.max_queue_wait
+            # Rate limit and backoff pauses are waited out before a slot is taken
+            await self._wait_for_token(deadline)
+            await self._acquire_slot(semaphore, deadline)
+            try:
+                return await call()
+            except Exception as e:
+                if not is_retryable(e) or attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                attempt += 1
+                logger.warning(f"Model call throttled ({getattr(e, 'code', None)}); retry {attempt} in {delay:.1f}s")
+            finally:
+                semaphore.release()
+
+
+model_scheduler = ModelCallScheduler()
@@ -0,0 +1,78 @@
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional
+
+from app.core.config import settings
+
+
+class PromptCache:
+    """Persistent cache of analysis prompts keyed by upload content hash.
+
+    An entry stores the prompt list produced for ``num_prompts``; a request for
+    fewer prompts is served by slicing the smallest cached list that is long
+    enough. Entries expire after ``ttl`` seconds and the least recently used
+    ones are evicted once there are more than ``max_entries``.
+    """
+
+    def __init__(self, db_path: Path = None, ttl: float = None, max_entries: int = None):
+        self.db_path = Path(db_path or settings.PROMPT_CACHE_PATH)
+        self.ttl = ttl if ttl is not None else settings.PROMPT_CACHE_TTL
+        self.max_entries = max(1, max_entries or settings.PROMPT_CACHE_MAX_ENTRIES)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS prompt_cache (
+                content_hash TEXT NOT NULL,
+                num_prompts INTEGER NOT NULL,
+                prompts TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (content_hash, num_prompts)
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_prompt_cache_last_used ON prompt_cache(last_used)")
+        self._conn.commit()
+
+    def get(self, content_hash: str, num_prompts: int) -> Optional[List[str]]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT num_prompts, prompts FROM prompt_cache "
+                "WHERE content_hash = ? AND num_prompts >= ? AND created_at > ? "
+                "ORDER BY num_prompts LIMIT 1",
+                (content_hash, num_prompts, now - self.ttl),
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE prompt_cache SET last_used = ? WHERE content_hash = ? AND num_prompts = ?",
+                (now, content_hash, row[0]),
+            )
+            self._conn.commit()
+        return json.loads(row[1])[:num_prompts]
+
+    def put(self, content_hash: str, prompts: List[str]):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO prompt_cache (content_hash, num_prompts, prompts, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (content_hash, len(prompts), json.dumps(prompts), now, now),
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float):
+        self._conn.execute("DELETE FROM prompt_cache WHERE created_at <= ?", (now - self.ttl,))
+        self._conn.execute(
+            "DELETE FROM prompt_cache WHERE rowid IN ("
+            "SELECT rowid FROM prompt_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+
+prompt_cache = PromptCache()
@@ -0,0 +1,371 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS uploads (
+    file_id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    file_type TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    content_hash TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_uploads_user_created_file ON uploads(user_id, created_at, file_id);
+CREATE INDEX IF NOT EXISTS idx_uploads_content_hash ON uploads(content_hash);
+
+CREATE TABLE IF NOT EXISTS generated_files (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    file_id TEXT NOT NULL REFERENCES uploads(file_id),
+    filename TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    variants TEXT,
+    thumbnail_url TEXT,
+    placeholder TEXT,
+    style TEXT,
+    description TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_generated_file_id ON generated_files(file_id);
+CREATE INDEX IF NOT EXISTS idx_generated_filename ON generated_files(filename);
+
+CREATE TABLE IF NOT EXISTS user_versions (
+    user_id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS store_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+class SQLiteFileManager:
+    """FileManager backed by an indexed SQLite database in WAL mode.
+
+    Exposes the same public methods as the JSON ``FileManager``; every write
+    touches only the affected rows and every lookup goes through an index on
+    ``user_id``, ``file_id`` or the generated ``filename``. Nothing is cached
+    in memory, so several uvicorn workers can share one database file: writes
+    are serialized by SQLite's write lock and reads see every committed change.
+    Each thread has its own connection, so a write waiting for the lock in a
+    worker thread never holds up reads on the event loop.
+    """
+
+    def __init__(
+        self,
+        db_path: str = "file_metadata.db",
+        legacy_json_path: Optional[str] = "file_metadata.json",
+        busy_timeout: float = 30.0
+    ):
+        self.db_path = Path(db_path)
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self._connection().executescript(SCHEMA)
+        if legacy_json_path:
+            self._migrate_from_json(Path(legacy_json_path))
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread, opened on first use. A connection must not
+        # be shared across a fork either, so a forked worker opens its own.
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(
+                str(self.db_path), timeout=self.busy_timeout, isolation_level=None, check_same_thread=False
+            )
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    @contextmanager
+    def _read(self):
+        # Autocommit reads in WAL mode always see the latest commit from any process
+        yield self._connection()
+
+    @contextmanager
+    def _write(self):
+        """Run a write transaction that excludes writers in this and every other process.
+
+        BEGIN IMMEDIATE takes the database write lock up front (waiting up to
+        ``busy_timeout`` for it), so a read-then-write sequence inside the
+        block cannot be interleaved with another worker's write.
+        """
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _migrate_from_json(self, json_path: Path):
+        """One-time import of the legacy file_metadata.json"""
+        # Already imported: skip reading and replaying the legacy snapshot and journal altogether
+        with self._read() as conn:
+            if conn.execute("SELECT 1 FROM store_meta WHERE key = 'json_migrated'").fetchone():
+                return
+        # Read before taking the write lock; the marker check below keeps concurrent workers from importing twice
+        from app.services.file_manager import load_json_metadata
+        metadata = load_json_metadata(json_path)
+        if not metadata:
+            return
+        with self._write() as conn:
+            done = conn.execute("SELECT value FROM store_meta WHERE key = 'json_migrated'").fetchone()
+            if done:
+                return
+            for file_id, file_info in metadata.items():
+                conn.execute(
+                    "INSERT OR IGNORE INTO uploads (file_id, user_id, filename, file_type, created_at, content_hash) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (file_id, file_info["user_id"], file_info["filename"],
+                     file_info.get("file_type", "upload"), file_info["created_at"], file_info.get("content_hash"))
+                )
+                for generated_file in file_info.get("generated_files", []):
+                    self._insert_generated(conn, file_id, generated_file)
+            conn.execute(
+                "INSERT INTO store_meta (key, value) VALUES ('json_migrated', ?)",
+                (datetime.utcnow().isoformat(),)
+            )
+        logger.info(f"Migrated {len(metadata)} files from {json_path} to {self.db_path}")
+
+    @staticmethod
+    def _insert_generated(conn: sqlite3.Connection, original_file_id: str, generated_file: Dict):
+        variants = generated_file.get("variants")
+        conn.execute(
+            "INSERT INTO generated_files "
+            "(file_id, filename, created_at, variants, thumbnail_url, placeholder, style, description) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (original_file_id, generated_file["filename"], generated_file["created_at"],
+             json.dumps(variants) if variants else None,
+             generated_file.get("thumbnail_url"), generated_file.get("placeholder"),
+             generated_file.get("style"), generated_file.get("description"))
+        )
+
+    @staticmethod
+    def _generated_row_to_dict(row: sqlite3.Row) -> Dict:
+        generated_file = {
+            "filename": row["filename"],
+            "created_at": row["created_at"]
+        }
+        if row["variants"]:
+            generated_file["variants"] = json.loads(row["variants"])
+        if row["thumbnail_url"]:
+            generated_file["thumbnail_url"] = row["thumbnail_url"]
+        for key in ("placeholder", "style", "description"):
+            if row[key]:
+                generated_file[key] = row[key]
+        return generated_file
+
+    @staticmethod
+    def _bump_version(conn: sqlite3.Connection, user_id: str):
+        conn.execute(
+            "INSERT INTO user_versions (user_id, version) VALUES (?, 1) "
+            "ON CONFLICT(user_id) DO UPDATE SET version = version + 1",
+            (user_id,)
+        )
+
+    def get_user_version(self, user_id: str) -> str:
+        """Opaque token that changes whenever the user's files or generations change"""
+        with self._read() as conn:
+            row = conn.execute("SELECT version FROM user_versions WHERE user_id = ?", (user_id,)).fetchone()
+        return str(row["version"] if row else 0)
+
+    def register_file(
+        self, file_id: str, user_id: str, filename: str, file_type: str = "upload", content_hash: Optional[str] = None
+    ):
+        """Record an upload; ``filename`` is the stored file in UPLOAD_DIR, ``content_hash`` its SHA-256 blob key"""
+        with self._write() as conn:
+            previous = conn.execute("SELECT user_id FROM uploads WHERE file_id = ?", (file_id,)).fetchone()
+            # Re-registering a file_id resets it, as the JSON store does
+            conn.execute("DELETE FROM generated_files WHERE file_id = ?", (file_id,))
+            conn.execute(
+                "INSERT OR REPLACE INTO uploads (file_id, user_id, filename, file_type, created_at, content_hash) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (file_id, user_id, filename, file_type, datetime.utcnow().isoformat(), content_hash)
+            )
+            self._bump_version(conn, user_id)
+            if previous and previous["user_id"] != user_id:
+                self._bump_version(conn, previous["user_id"])
+
+    def add_generated_files(self, original_file_id: str, images: List[Dict]):
+        """Register several generated images of one upload in a single transaction"""
+        created_at = datetime.utcnow().isoformat()
+        with self._write() as conn:
+            owner = conn.execute(
+                "SELECT user_id FROM uploads WHERE file_id = ?", (original_file_id,)
+            ).fetchone()
+            if not owner:
+                return
+            images = [image_info for image_info in images if image_info.get("filename")]
+            for image_info in images:
+                self._insert_generated(conn, original_file_id, {**image_info, "created_at": created_at})
+            if images:
+                self._bump_version(conn, owner["user_id"])
+
+    def add_generated_file(
+        self,
+        original_file_id: str,
+        generated_filename: str,
+        variants: Optional[List[Dict]] = None,
+        thumbnail_url: Optional[str] = None,
+        placeholder: Optional[str] = None
+    ):
+        self.add_generated_files(original_file_id, [{
+            "filename": generated_filename,
+            "variants": variants,
+            "thumbnail_url": thumbnail_url,
+            "placeholder": placeholder
+        }])
+
+    def get_file_owner(self, file_id: str) -> Optional[str]:
+        with self._read() as conn:
+            row = conn.execute("SELECT user_id FROM uploads WHERE file_id = ?", (file_id,)).fetchone()
+        return row["user_id"] if row else None
+
+    @staticmethod
+    def _upload_row_to_dict(row: sqlite3.Row) -> Dict:
+        upload = {
+            "file_id": row["file_id"],
+            "user_id": row["user_id"],
+            "filename": row["filename"],
+            "file_type": row["file_type"],
+            "created_at": row["created_at"]
+        }
+        if row["content_hash"]:
+            upload["content_hash"] = row["content_hash"]
+        return upload
+
+    def get_upload(self, file_id: str) -> Optional[Dict]:
+        """The upload record without its generated images"""
+        with self._read() as conn:
+            row = conn.execute("SELECT * FROM uploads WHERE file_id = ?", (file_id,)).fetchone()
+        return self._upload_row_to_dict(row) if row else None
+
+    def count_content_references(self, content_hash: str) -> int:
+        with self._read() as conn:
+            row = conn.execute(
+                "SELECT COUNT(*) AS refs FROM uploads WHERE content_hash = ?", (content_hash,)
+            ).fetchone()
+        return row["refs"]
+
+    def get_generation(self, file_id: str) -> Optional[Dict]:
+        """One upload and its generated images (the generation manifest), by primary key"""
+        with self._read() as conn:
+            upload = conn.execute("SELECT * FROM uploads WHERE file_id = ?", (file_id,)).fetchone()
+            if upload is None:
+                return None
+            generated_rows = conn.execute(
+                "SELECT * FROM generated_files WHERE file_id = ? ORDER BY id", (file_id,)
+            ).fetchall()
+        return {
+            **self._upload_row_to_dict(upload),
+            "generated_files": [self._generated_row_to_dict(row) for row in generated_rows]
+        }
+
+    def get_user_files(
+        self, user_id: str, limit: Optional[int] = None, after: Optional[Tuple[str, str]] = None
+    ) -> List[Dict]:
+        """The user's uploads oldest first, optionally only those after a (created_at, file_id) cursor"""
+        page = "SELECT * FROM uploads WHERE user_id = ?"
+        params: list = [user_id]
+        if after:
+            page += " AND (created_at, file_id) > (?, ?)"
+            params.extend(after)
+        page += " ORDER BY created_at, file_id LIMIT ?"
+        params.append(-1 if limit is None else limit)
+
+        with self._read() as conn:
+            uploads = conn.execute(page, params).fetchall()
+            # Join on the same page rather than binding one parameter per upload
+            generated_rows = conn.execute(
+                f"SELECT g.* FROM generated_files g JOIN ({page}) p ON p.file_id = g.file_id ORDER BY g.id",
+                params
+            ).fetchall() if uploads else []
+
+        generated_by_file: Dict[str, List[Dict]] = {}
+        for row in generated_rows:
+            generated_by_file.setdefault(row["file_id"], []).append(self._generated_row_to_dict(row))
+
+        return [{
+            **self._upload_row_to_dict(upload),
+            "generated_files": generated_by_file.get(upload["file_id"], [])
+        } for upload in uploads]
+
+    def get_user_generations(
+        self, user_id: str, limit: Optional[int] = None, before: Optional[Tuple[str, str]] = None
+    ) -> List[Dict]:
+        """Get user's generation history formatted for timeline display.
+
+        Newest first; ``before`` is the (created_at, file_id) of the last item
+        of the previous page.
+        """
+        query = """SELECT u.file_id, u.filename, u.created_at,
+                          (SELECT COUNT(*) FROM generated_files c WHERE c.file_id = u.file_id) AS generated_count,
+                          g.filename AS first_filename, g.thumbnail_url, g.placeholder
+                   FROM uploads u
+                   JOIN generated_files g ON g.id = (
+                       SELECT MIN(id) FROM generated_files WHERE file_id = u.file_id
+                   )
+                   WHERE u.user_id = ?"""
+        params: list = [user_id]
+        if before:
+            query += " AND (u.created_at, u.file_id) < (?, ?)"
+            params.extend(before)
+        query += " ORDER BY u.created_at DESC, u.file_id DESC LIMIT ?"
+        params.append(-1 if limit is None else limit)
+
+        with self._read() as conn:
+            rows = conn.execute(query, params).fetchall()
+
+        return [{
+            "generation_id": row["file_id"],
+            "original_filename": row["filename"],
+            "created_at": row["created_at"],
+            "generated_count": row["generated_count"],
+            "thumbnail_url": row["thumbnail_url"] or f"/generated/{row['first_filename']}",
+            "placeholder": row["placeholder"],
+            "status": "completed"
+        } for row in rows]
+
+    def user_owns_file(self, file_id: str, user_id: str) -> bool:
+        return self.get_file_owner(file_id) == user_id
+
+    def get_generated_file(self, filename: str) -> Optional[Dict]:
+        with self._read() as conn:
+            row = conn.execute(
+                "SELECT * FROM generated_files WHERE filename = ? ORDER BY id LIMIT 1", (filename,)
+            ).fetchone()
+        return self._generated_row_to_dict(row) if row else None
+
+    def user_owns_generated_file(self, filename: str, user_id: str) -> bool:
+        with self._read() as conn:
+            row = conn.execute(
+                "SELECT 1 FROM generated_files g JOIN uploads u ON u.file_id = g.file_id "
+                "WHERE g.filename = ? AND u.user_id = ? LIMIT 1",
+                (filename, user_id)
+            ).fetchone()
+        return row is not None
+
+    def close(self):
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+        self._local = threading.local()
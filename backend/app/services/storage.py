@@ -0,0 +1,62 @@
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+from typing import BinaryIO, Tuple
+
+
+class FileTooLargeError(Exception):
+    """Raised by save_stream_to_temp once more than ``max_size`` bytes have been read"""
+    pass
+
+
+def write_atomic(path: Path, data: bytes, fsync: bool = False):
+    """Write bytes to a temp file in the target directory and rename it into place.
+
+    Readers see either the old file or the complete new one, never a
+    truncated or half-written file. With ``fsync`` the data is flushed to disk
+    before the rename, so the new file also survives a power loss.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def save_stream_to_temp(source: BinaryIO, directory: Path, max_size: int, chunk_size: int = 1024 * 1024) -> Tuple[Path, int, str]:
+    """Copy a file-like object to a new temp file in ``directory`` chunk by chunk.
+
+    Only one chunk is held in memory and the data is hashed as it is
+    written. Returns (temp path, size, sha256 hex digest); the caller renames
+    or removes the temp file. The copy stops with FileTooLargeError as soon
+    as ``max_size`` is exceeded, and the temp file is removed.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".upload.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while chunk := source.read(chunk_size):
+                size += len(chunk)
+                if size > max_size:
+                    raise FileTooLargeError(f"Upload exceeds {max_size} bytes")
+                digest.update(chunk)
+                f.write(chunk)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    return Path(tmp_path), size, digest.hexdigest()
+
@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import os
+import re
+import time
+from pathlib import Path
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.services.file_manager import file_manager
+from app.services.image_input import validate_image_header
+from app.services.storage import save_stream_to_temp
+
+logger = logging.getLogger(__name__)
+
+# Spellings of the same format share one blob
+_CANONICAL_EXTENSIONS = {".jpeg": ".jpg"}
+
+# A blob "<sha256>.<ext>" and its normalized model inputs "<sha256>.model-<edge>.<ext>"
+_BLOB_NAME = re.compile(r"^([0-9a-f]{64})\.")
+
+
+def blob_path(content_hash: str, extension: str) -> Path:
+    extension = extension.lower()
+    return settings.UPLOAD_DIR / f"{content_hash}{_CANONICAL_EXTENSIONS.get(extension, extension)}"
+
+
+def save_upload(source: BinaryIO, extension: str, content_type: Optional[str] = None) -> Tuple[Path, str]:
+    """Store an upload under its SHA-256 and return (blob path, content hash).
+
+    Identical content is kept once however many times, or by however many
+    users, it is uploaded; each upload still gets its own file_id in the
+    FileManager, which records the blob's filename and hash. The stream is
+    hashed while it is copied, so the content is read exactly once, and its
+    header is validated before it is kept (InvalidImageError otherwise).
+
+    Blob names are internal: uploads are served by file_id to their owner,
+    never by hash. Reusing a blob marks it as in use for
+    ``sweep_unreferenced_blobs``, which is the only place blobs are deleted.
+    """
+    tmp_path, _, content_hash = save_stream_to_temp(
+        source, settings.UPLOAD_DIR, settings.MAX_FILE_SIZE, settings.UPLOAD_CHUNK_SIZE
+    )
+    try:
+        validate_image_header(tmp_path, extension, content_type)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    path = blob_path(content_hash, extension)
+    try:
+        # Keep the existing blob's mtime so its cached model input stays valid; only the access time moves
+        os.utime(path, ns=(time.time_ns(), path.stat().st_mtime_ns))
+        os.unlink(tmp_path)
+    except FileNotFoundError:
+        os.replace(tmp_path, path)
+    return path, content_hash
+
+
+def sweep_unreferenced_blobs(grace_seconds: float = None) -> int:
+    """Delete blobs that no upload references, together with their normalized model inputs.
+
+    A blob is only removed once neither it nor its model inputs have been
+    written or reused for ``grace_seconds``, which covers the moment between
+    ``save_upload`` returning and the upload being registered. Returns the
+    number of blobs removed.
+    """
+    grace_seconds = settings.UPLOAD_SWEEP_GRACE if grace_seconds is None else grace_seconds
+    files_by_hash: Dict[str, List[str]] = {}
+    for entry in os.scandir(settings.UPLOAD_DIR):
+        match = _BLOB_NAME.match(entry.name)
+        if match and entry.is_file():
+            files_by_hash.setdefault(match.group(1), []).append(entry.path)
+
+    removed = 0
+    for content_hash, paths in files_by_hash.items():
+        if file_manager.count_content_references(content_hash):
+            continue
+        # Checked after the references, so a reuse that lands in between is still seen
+        cutoff = time.time() - grace_seconds
+        try:
+            if any(max(stat.st_atime, stat.st_mtime) >= cutoff for stat in map(os.stat, paths)):
+                continue
+        except FileNotFoundError:
+            continue
+        for path in paths:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+        removed += 1
+    return removed
+
+
+class UploadSweeper:
+    """Runs ``sweep_unreferenced_blobs`` in the background every ``interval`` seconds"""
+
+    def __init__(self, interval: float = None):
+        self.interval = interval if interval is not None else settings.UPLOAD_SWEEP_INTERVAL
+        self._task: Optional[asyncio.Task] = None
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                removed = await asyncio.to_thread(sweep_unreferenced_blobs)
+                if removed:
+                    logger.info(f"Removed {removed} unreferenced upload blobs")
+            except Exception as e:
+                logger.error(f"Sweeping unreferenced upload blobs failed: {e}")
+
+    def start(self):
+        if self.interval <= 0:
+            return
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._sweep_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+upload_sweeper = UploadSweeper()
+
@@ -0,0 +1,105 @@
+import multiprocessing
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from app.services.sqlite_file_manager import SQLiteFileManager
+
+WRITERS = 4
+FILES_PER_WRITER = 25
+
+
+def _writer(db_path: str, worker: int):
+    store = SQLiteFileManager(db_path, legacy_json_path=None, busy_timeout=30)
+    for i in range(FILES_PER_WRITER):
+        store.register_file(f"w{worker}-{i}", "shared-user", f"w{worker}-{i}.jpg")
+        # Every process appends to the same upload, so lost updates would show up in the count
+        store.add_generated_file("shared-upload", f"w{worker}-{i}_generated_1.png")
+        store.add_generated_files(f"w{worker}-{i}", [
+            {"filename": f"w{worker}-{i}_generated_1.png"},
+            {"filename": f"w{worker}-{i}_generated_2.png"},
+        ])
+    store.close()
+
+
+def test_concurrent_writers_in_multiple_processes(tmp_path):
+    db_path = str(tmp_path / "file_metadata.db")
+    reader = SQLiteFileManager(db_path, legacy_json_path=None)
+    reader.register_file("shared-upload", "owner", "shared.jpg")
+
+    ctx = multiprocessing.get_context("spawn")
+    processes = [ctx.Process(target=_writer, args=(db_path, worker)) for worker in range(WRITERS)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=120)
+    assert all(process.exitcode == 0 for process in processes)
+
+    # The reader opened its connection before the writers ran and still sees all their commits
+    files = reader.get_user_files("shared-user")
+    assert len(files) == WRITERS * FILES_PER_WRITER
+    assert all(len(file_info["generated_files"]) == 2 for file_info in files)
+
+    shared = reader.get_user_files("owner")[0]
+    assert len(shared["generated_files"]) == WRITERS * FILES_PER_WRITER
+    assert reader.user_owns_generated_file("w0-0_generated_1.png", "owner")
+    assert reader.user_owns_generated_file("w0-0_generated_2.png", "shared-user")
+
+
+def test_reads_do_not_wait_for_a_blocked_write(tmp_path):
+    db_path = str(tmp_path / "file_metadata.db")
+    store = SQLiteFileManager(db_path, legacy_json_path=None, busy_timeout=30)
+    store.register_file("existing", "user", "existing.jpg")
+
+    # Another process holds the write lock, so the store's next write has to wait for it
+    other = sqlite3.connect(db_path, isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+    writer = threading.Thread(target=store.register_file, args=("blocked", "user", "blocked.jpg"))
+    writer.start()
+    time.sleep(0.2)
+
+    started = time.monotonic()
+    assert store.get_upload("existing")["user_id"] == "user"
+    assert time.monotonic() - started < 1
+    assert writer.is_alive()
+
+    other.execute("COMMIT")
+    writer.join(timeout=10)
+    assert store.get_upload("blocked")["user_id"] == "user"
+    other.close()
+    store.close()
+
+
+def _open_json_store(metadata_path: str, results):
+    from app.services.file_manager import FileManager
+    try:
+        FileManager(metadata_path)
+        results.put("opened")
+    except RuntimeError:
+        results.put("refused")
+
+
+def test_json_store_refuses_a_second_process(tmp_path, monkeypatch):
+    pytest.importorskip("fcntl")
+    monkeypatch.setenv("SUPABASE_URL", "http://localhost")
+    monkeypatch.setenv("SUPABASE_ANON_KEY", "test")
+    monkeypatch.setenv("METADATA_DB_PATH", str(tmp_path / "file_metadata.db"))
+    monkeypatch.chdir(tmp_path)
+    from app.services.file_manager import FileManager
+
+    metadata_path = str(tmp_path / "file_metadata.json")
+    store = FileManager(metadata_path)
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    process = ctx.Process(target=_open_json_store, args=(metadata_path, results))
+    process.start()
+    process.join(timeout=60)
+    assert results.get(timeout=5) == "refused"
+
+    store.close()
+    process = ctx.Process(target=_open_json_store, args=(metadata_path, results))
+    process.start()
+    process.join(timeout=60)
+    assert results.get(timeout=5) == "opened"
@@ -174,6 +174,8 @@ const EnhancedUploadZone = ({
         toast.error('❌ Insufficient credits. Please refresh and try again.');
       } else if (error.response?.status === 400) {
         toast.error('❌ Invalid request. Please check your image and try again.');
+      } else if (error.response?.status === 503) {
+        toast.error('❌ Image generation is temporarily unavailable. Please try again in a minute.');
       } else {
         toast.error('❌ Generation failed. Please try again.');
       }
@@ -33,8 +33,7 @@ import {
   RefreshCw,
   X
 } from "lucide-react";
-import { useQuery } from '@tanstack/react-query';
-import { Generation, getUserGenerations } from '@/lib/api';
+import { useUserGenerations } from '@/hooks/useUserGenerations';
 import GenerationCard from './GenerationCard';
 
 interface GenerationGridProps {
@@ -65,11 +64,15 @@ const GenerationGrid = ({
   const [sortBy, setSortBy] = useState<SortOption>('newest');
   const [filterBy, setFilterBy] = useState<FilterOption>('all');
 
-  const { data: generations = [], isLoading, error, refetch } = useQuery({
-    queryKey: ['generations'],
-    queryFn: getUserGenerations,
-    refetchOnWindowFocus: false
-  });
+  const {
+    generations,
+    isLoading,
+    error,
+    refetch,
+    hasNextPage,
+    fetchNextPage,
+    isFetchingNextPage
+  } = useUserGenerations();
 
   const filteredAndSortedGenerations = useMemo(() => {
     let filtered = [...generations];
@@ -455,6 +458,18 @@ const GenerationGrid = ({
           ))}
         </div>
       )}
+
+      {hasNextPage && (
+        <div className="flex justify-center">
+          <Button
+            variant="outline"
+            onClick={() => fetchNextPage()}
+            disabled={isFetchingNextPage}
+          >
+            {isFetchingNextPage ? 'Loading...' : 'Load more'}
+          </Button>
+        </div>
+      )}
     </div>
   );
 };
@@ -63,7 +63,7 @@ const GenerationPanel = ({
   const minSwipeDistance = 50;
 
   const moreLikeThisMutation = useMutation({
-    mutationFn: ({ imageUrl, style, quantity }: { imageUrl: string; style: string; quantity: number }) =>
+    mutationFn: ({ imageUrl, style, quantity }: { imageUrl: string; style?: string; quantity: number }) =>
       generateSimilarImages(imageUrl, style, quantity),
     onMutate: ({ quantity }) => {
       const cost = (costPerImage || 1) * quantity;
@@ -208,7 +208,7 @@ const GenerationPanel = ({
     }
   };
 
-  const handleMoreLikeThis = (imageUrl: string, style: string) => {
+  const handleMoreLikeThis = (imageUrl: string, style?: string) => {
     const cost = (costPerImage || 1) * (numImages || 1);
     if ((credits ?? 0) < cost) {
       toast.error(`Not enough credits. Need ${cost}, you have ${credits}.`);
@@ -224,12 +224,13 @@ const GenerationPanel = ({
     toast.info(`🎨 Generating ${numImages} similar images...`);
   };
 
-  const getStyleInfo = (style: string, index: number) => {
+  const getStyleInfo = (style: string | undefined, index: number) => {
     const styleIcons = ['🛍️', '📸', '📋', '🎨', '🚀', '🎆', '🌈', '💫', '✨', '🎯'];
     const styleNames = ['E-Commerce', 'Social Media', 'Catalog', 'Artistic', 'Dynamic', 'Premium', 'Lifestyle', 'Minimalist', 'Luxury', 'Editorial'];
 
-    if (style.startsWith('style_')) {
-      const styleNumber = parseInt(style.split('_')[1]) - 1;
+    // Images without a named style are labelled by position
+    if (!style || style.startsWith('style_')) {
+      const styleNumber = style ? parseInt(style.split('_')[1]) - 1 : index;
       return {
         icon: styleIcons[styleNumber % styleIcons.length],
         name: styleNames[styleNumber % styleNames.length],
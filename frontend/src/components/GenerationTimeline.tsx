@@ -5,8 +5,7 @@ import { Badge } from "@/components/ui/badge";
 import { Skeleton } from "@/components/ui/skeleton";
 import { ScrollArea } from "@/components/ui/scroll-area";
 import { Plus, Calendar, ImageIcon, Clock, CheckCircle2 } from "lucide-react";
-import { useQuery } from '@tanstack/react-query';
-import { Generation, getUserGenerations } from '@/lib/api';
+import { useUserGenerations } from '@/hooks/useUserGenerations';
 import { formatDate } from '@/lib/utils';
 
 interface GenerationTimelineProps {
@@ -20,11 +19,7 @@ const GenerationTimeline = ({
   onSelectGeneration,
   onNewGeneration
 }: GenerationTimelineProps) => {
-  const { data: generations = [], isLoading, error } = useQuery({
-    queryKey: ['generations'],
-    queryFn: getUserGenerations,
-    refetchOnWindowFocus: false
-  });
+  const { generations, isLoading, error, hasNextPage, fetchNextPage, isFetchingNextPage } = useUserGenerations();
 
 
   const getStatusColor = (status: string) => {
@@ -202,6 +197,20 @@ const GenerationTimeline = ({
                   </Card>
                 ))}
 
+                {/* Load the next page of older generations */}
+                {hasNextPage && (
+                  <Card className="min-w-[200px] p-6 flex items-center justify-center">
+                    <Button
+                      variant="outline"
+                      size="sm"
+                      onClick={() => fetchNextPage()}
+                      disabled={isFetchingNextPage}
+                    >
+                      {isFetchingNextPage ? 'Loading...' : 'Load more'}
+                    </Button>
+                  </Card>
+                )}
+
                 {/* Add New Generation Card */}
                 <Card
                   className="min-w-[200px] p-6 text-center cursor-pointer hover:shadow-medium transition-all duration-300 border-2 border-dashed border-muted-foreground/30 hover:border-primary/50 bg-muted/30 hover:bg-primary/5"
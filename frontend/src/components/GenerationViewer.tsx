@@ -43,7 +43,7 @@ const GenerationViewer = ({ generationId, onBack }: GenerationViewerProps) => {
   });
 
 
-  const getStyleInfo = (style: string, index: number) => {
+  const getStyleInfo = (style: string | undefined, index: number) => {
     const styleIcons = ['🛍️', '📸', '📋', '🎨', '🚀', '🎆', '🌈', '💫', '✨', '🎯'];
     const styleNames = ['E-Commerce', 'Social Media', 'Catalog', 'Artistic', 'Dynamic', 'Premium', 'Lifestyle', 'Minimalist', 'Luxury', 'Editorial'];
     const styleColors = [
@@ -59,8 +59,9 @@ const GenerationViewer = ({ generationId, onBack }: GenerationViewerProps) => {
       'bg-emerald-500/10 text-emerald-700 border-emerald-200'
     ];
 
-    if (style.startsWith('style_')) {
-      const styleNumber = parseInt(style.split('_')[1]) - 1;
+    // Images without a named style are labelled by position
+    if (!style || style.startsWith('style_')) {
+      const styleNumber = style ? parseInt(style.split('_')[1]) - 1 : index;
       return {
         icon: styleIcons[styleNumber % styleIcons.length],
         name: styleNames[styleNumber % styleNames.length],
@@ -233,7 +234,7 @@ const GenerationViewer = ({ generationId, onBack }: GenerationViewerProps) => {
                 <div className="aspect-square relative overflow-hidden">
                   <img
                     src={image.url}
-                    alt={`AI Generated ${image.style}`}
+                    alt={`AI Generated ${styleInfo.name}`}
                     className="w-full h-full object-cover transition-transform duration-500 group-hover:scale-110"
                     loading="lazy"
                   />
@@ -0,0 +1,29 @@
+import { useMemo } from 'react'
+import { useInfiniteQuery } from '@tanstack/react-query'
+import { getUserGenerations } from '@/lib/api'
+
+interface UseUserGenerationsOptions {
+  enabled?: boolean
+  retry?: number
+  refetchOnWindowFocus?: boolean
+  staleTime?: number
+}
+
+// Generation history, loaded one page at a time; call fetchNextPage to load older entries
+export function useUserGenerations(options: UseUserGenerationsOptions = {}) {
+  const query = useInfiniteQuery({
+    queryKey: ['generations'],
+    queryFn: ({ pageParam }) => getUserGenerations(pageParam),
+    initialPageParam: null as string | null,
+    getNextPageParam: (lastPage) => lastPage.next_cursor,
+    refetchOnWindowFocus: false,
+    ...options
+  })
+
+  const generations = useMemo(
+    () => query.data?.pages.flatMap((page) => page.generations) ?? [],
+    [query.data]
+  )
+
+  return { ...query, generations }
+}
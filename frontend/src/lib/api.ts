@@ -7,7 +7,7 @@ const api = axios;
 export interface GeneratedImage {
   filename: string;
   url: string;
-  style: string;
+  style?: string;
   description: string;
 }
 
@@ -32,6 +32,11 @@ export interface Generation {
   status: string;
 }
 
+export interface GenerationsPage {
+  generations: Generation[];
+  next_cursor: string | null;
+}
+
 export interface GenerationDetails {
   generation_id: string;
   original_filename: string;
@@ -113,8 +118,11 @@ export const downloadImage = async (url: string, filename: string): Promise<void
 };
 
 // Timeline/History API functions
-export const getUserGenerations = async (): Promise<Generation[]> => {
-  const response = await api.get<{ generations: Generation[] }>('/generations');
+export const getUserGenerations = async (cursor?: string | null): Promise<GenerationsPage> => {
+  // One page per call; pass the previous page's next_cursor to load older generations
+  const response = await api.get<GenerationsPage>('/generations', {
+    params: cursor ? { cursor } : {}
+  });
 
   // Transform URLs to be absolute
   const configuredBase = (import.meta as any).env?.VITE_API_BASE_URL || axios.defaults.baseURL || '';
@@ -124,10 +132,13 @@ export const getUserGenerations = async (): Promise<Generation[]> => {
     return /^https?:\/\//i.test(u) ? u : (API_BASE_URL ? `${API_BASE_URL}${u}` : u);
   };
 
-  return response.data.generations.map(gen => ({
-    ...gen,
-    thumbnail_url: toAbsoluteUrl(gen.thumbnail_url)
-  }));
+  return {
+    ...response.data,
+    generations: response.data.generations.map(gen => ({
+      ...gen,
+      thumbnail_url: toAbsoluteUrl(gen.thumbnail_url)
+    }))
+  };
 };
 
 export const generateSimilarImages = async (
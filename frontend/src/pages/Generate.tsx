@@ -21,9 +21,9 @@ import Footer from "@/components/Footer";
 import EnhancedUploadZone from "@/components/EnhancedUploadZone";
 import GenerationGrid from "@/components/GenerationGrid";
 import GenerationPanel from "@/components/GenerationPanel";
-import { GeneratedImage, getUserGenerations } from "@/lib/api";
+import { GeneratedImage } from "@/lib/api";
 import { useAuth } from "@/contexts/AuthContext";
-import { useQuery } from '@tanstack/react-query';
+import { useUserGenerations } from '@/hooks/useUserGenerations';
 import { toast } from 'sonner';
 
 interface UploadItem {
@@ -50,9 +50,7 @@ const Generate = () => {
   const [searchParams, setSearchParams] = useSearchParams();
 
   // Fetch generations for smart initial state
-  const { data: generations = [], isLoading } = useQuery({
-    queryKey: ['generations'],
-    queryFn: getUserGenerations,
+  const { generations, isLoading } = useUserGenerations({
     enabled: !!user && !!session?.access_token && authReady && !loading, // Wait for auth and loading complete
     refetchOnWindowFocus: false,
     retry: 1, // Reduce retries to prevent spam